@@ -0,0 +1,39 @@
+# attribute_similarity.py (マッチしたクラスペアの属性類似度をまとめて計算する)
+
+import numpy as np
+
+from similarity_calculator import cosine_matrix
+
+
+class AttributeSimilarities:
+    """
+    マッチした全クラスペアの属性を集め、重複を除いた属性を1回の encode でまとめて埋め込みます。
+    各クラスペアの属性類似度行列は、その埋め込み行列から切り出して計算します。
+    """
+    def __init__(self, calculator, attribute_lists):
+        unique_attrs = list(dict.fromkeys(attr for attrs in attribute_lists for attr in attrs))
+        self.position = {attr: i for i, attr in enumerate(unique_attrs)}
+        self.embeddings = None
+        if unique_attrs:
+            self.embeddings = calculator.encode(unique_attrs)
+
+    @classmethod
+    def from_matches(cls, calculator, matches):
+        """find_best_matches が返した matches の全クラスペアの属性を対象にします。"""
+        attribute_lists = []
+        for score_tuple in matches:
+            cls_a, cls_b = score_tuple[5], score_tuple[6]
+            attribute_lists.append(cls_a.attributes)
+            attribute_lists.append(cls_b.attributes)
+        return cls(calculator, attribute_lists)
+
+    def __len__(self):
+        return len(self.position)
+
+    def block(self, attrs_a, attrs_b):
+        """attrs_a × attrs_b のコサイン類似度行列を返します。"""
+        if self.embeddings is None or not attrs_a or not attrs_b:
+            return np.zeros((len(attrs_a), len(attrs_b)))
+        emb_a = self.embeddings[[self.position[attr] for attr in attrs_a]]
+        emb_b = self.embeddings[[self.position[attr] for attr in attrs_b]]
+        return cosine_matrix(attrs_a, emb_a, attrs_b, emb_b)
\ No newline at end of file
@@ -0,0 +1,130 @@
+# batch_merge.py (多数の図のペアを、モデルを1回だけ読み込んでまとめてマージする)
+#
+# 使い方: python batch_merge.py jobs.jsonl [--summary merge_summary.jsonl] [--workers 8]
+#
+# マニフェストは JSON Lines（1行1ジョブ）または JSON の配列で、各ジョブは次の形式です。
+#   {"a": "dataA.txt", "b": "dataB.txt", "output": "data_merged.txt",
+#    "threshold": 0.6, "weights": {"semantic": 0.7, "structural": 0.15, "spatial": 0.15}}
+# threshold と weights は省略できます。相対パスはマニフェストのあるディレクトリからの位置です。
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from file_io import collect_uml, iter_uml_file, write_uml_file
+from main import find_best_matches, merge_uml_data
+from multi_merge import diagram_texts
+from scoring import DEFAULT_WEIGHTS
+from similarity_calculator import SimilarityCalculator
+
+
+def load_manifest(manifest_path):
+    """マニフェストを読み込み、パスを絶対パスにしたジョブのリストを返します。"""
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    stripped = content.lstrip()
+    if stripped.startswith('['):
+        jobs = json.loads(stripped)
+    else:
+        jobs = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    for job in jobs:
+        for key in ("a", "b", "output"):
+            if key not in job:
+                raise ValueError(f"ジョブに '{key}' がありません: {job}")
+            job[key] = os.path.join(base_dir, job[key])
+    return jobs
+
+
+def _read_diagram(file_path):
+    """parse_uml_file と同じ形式で読み込みます。ファイルがなければ（メッセージは出さずに）None を返します。"""
+    try:
+        return collect_uml(iter_uml_file(file_path))
+    except FileNotFoundError:
+        return None
+
+
+def _parse_job(job):
+    return _read_diagram(job["a"]), _read_diagram(job["b"])
+
+
+def _job_summary(number, job):
+    return {"job": number, "a": job["a"], "b": job["b"], "output": job["output"]}
+
+
+def _run_job(number, job, data_a, data_b, calculator, strategy, layout):
+    summary = _job_summary(number, job)
+    if not (data_a and data_b):
+        summary.update(status="error", error="入力ファイルが見つかりません")
+        return summary
+    start = time.perf_counter()
+    threshold = job.get("threshold", 0.6)
+    weights = dict(DEFAULT_WEIGHTS, **job.get("weights", {}))
+    try:
+        matches, unmatched_a, unmatched_b, _ = find_best_matches(
+            data_a, data_b, calculator, threshold, weights, strategy, collect_all_scores=False)
+        merged = merge_uml_data(matches, unmatched_a, unmatched_b, data_a, data_b, calculator, layout=layout)
+        write_uml_file(job["output"], merged)
+    except Exception as e:
+        summary.update(status="error", error=f"{type(e).__name__}: {e}")
+        return summary
+    summary.update(status="ok", threshold=threshold, matches=len(matches),
+                   unmatched_a=len(unmatched_a), unmatched_b=len(unmatched_b),
+                   classes=len(merged["classes"]), relations=len(merged["relations"]),
+                   seconds=round(time.perf_counter() - start, 4))
+    return summary
+
+
+def run_batch(jobs, calculator, workers=8, strategy="greedy", layout="legacy"):
+    """
+    ジョブをまとめて実行し、ジョブごとの結果 (dict) のリストを入力の順で返します。
+    1. 全ジョブの入力ファイルを並行して読み込む
+    2. 全ジョブのクラスのテキストと属性を集め、calculator.preload で共通のバッチとしてエンコードする
+    3. ジョブごとのスコア計算・マージ・書き出しを並行して実行する
+    モデルの読み込みに失敗した場合は、どのジョブも実行せず（出力ファイルも書き出さず）、すべて失敗として返します。
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parsed = list(pool.map(_parse_job, jobs))
+
+        texts = [text for data_a, data_b in parsed if data_a and data_b
+                 for diagram in (data_a, data_b) for text in diagram_texts(diagram)]
+        calculator.preload(texts)
+        if calculator.load_failed:
+            return [dict(_job_summary(number, job), status="error", error="モデルを読み込めませんでした")
+                    for number, job in enumerate(jobs)]
+
+        futures = [pool.submit(_run_job, number, job, data_a, data_b, calculator, strategy, layout)
+                   for number, (job, (data_a, data_b)) in enumerate(zip(jobs, parsed))]
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="マニフェストに書かれた図のペアをまとめてマージします。")
+    parser.add_argument("manifest", help="ジョブのマニフェスト (JSON Lines または JSON 配列)")
+    parser.add_argument("--summary", default="merge_summary.jsonl", help="ジョブごとの結果を書き出す JSON Lines ファイル")
+    parser.add_argument("--workers", type=int, default=8, help="並行して処理するジョブ数")
+    parser.add_argument("--strategy", choices=["greedy", "optimal"], default="greedy")
+    parser.add_argument("--layout", choices=["legacy", "vectorized", "barnes_hut", "auto"], default="legacy")
+    parser.add_argument("--cache-dir", default=".embedding_cache")
+    parser.add_argument("--offline", action="store_true", help="モデルを読み込まず、キャッシュ済みの埋め込みだけを使う")
+    args = parser.parse_args()
+
+    jobs = load_manifest(args.manifest)
+    calculator = SimilarityCalculator(cache_dir=args.cache_dir, offline=args.offline)
+    summaries = run_batch(jobs, calculator, args.workers, args.strategy, args.layout)
+    calculator.close()
+
+    with open(args.summary, 'w', encoding='utf-8') as f:
+        for summary in summaries:
+            f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+    failed = sum(1 for s in summaries if s["status"] != "ok")
+    print(f"{len(summaries)} 件のジョブを処理しました（失敗 {failed} 件）。結果: '{args.summary}'")
+    if calculator.load_failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,59 @@
+# bench_file_io.py (クラス図ファイルの読み書きのスループット計測)
+#
+# 使い方: python bench_file_io.py [行数]
+# dataA.txt のレコードを ID を振り直しながら繰り返した一時ファイルを作り、
+# iter_uml_file / parse_uml_file / write_uml_file の処理速度を 行/秒 で表示します。
+
+import os
+import sys
+import tempfile
+import time
+
+from file_io import format_class, format_relation, iter_uml_file, parse_uml_file, write_uml_file
+
+def make_sample_file(file_path, n_lines, template_path="dataA.txt"):
+    """template_path のクラスと関連を、ID をずらしながら n_lines 行になるまで繰り返し書き出します。"""
+    template = parse_uml_file(template_path)
+    records = [(False, c) for c in template["classes"]] + [(True, r) for r in template["relations"]]
+    written, round_no = 0, 0
+    with open(file_path, 'w', encoding='utf-8') as f:
+        while written < n_lines:
+            offset = round_no * 1000
+            for is_relation, item in records:
+                if written >= n_lines:
+                    break
+                if is_relation:
+                    line = format_relation(type(item)(str(int(item.id) + offset), str(int(item.source_id) + offset),
+                                                      str(int(item.target_id) + offset), item.type,
+                                                      item.source_multiplicity, item.target_multiplicity))
+                else:
+                    line = format_class(type(item)(str(int(item.id) + offset), item.name, item.attributes,
+                                                   item.x, item.y))
+                f.write(line + "\n")
+                written += 1
+            round_no += 1
+
+def run(n_lines):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "input.txt")
+        output = os.path.join(tmp, "output.txt")
+        make_sample_file(source, n_lines)
+
+        start = time.perf_counter()
+        count = sum(1 for _ in iter_uml_file(source))
+        results["iter_uml_file"] = count / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        data = parse_uml_file(source)
+        results["parse_uml_file"] = n_lines / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        write_uml_file(output, data)
+        results["write_uml_file"] = n_lines / (time.perf_counter() - start)
+    return results
+
+if __name__ == "__main__":
+    n_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for name, lines_per_sec in run(n_lines).items():
+        print(f"{name:<16}{lines_per_sec:>14,.0f} 行/秒")
\ No newline at end of file
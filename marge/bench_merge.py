@@ -0,0 +1,171 @@
+# bench_merge.py (マージ処理全体のスケーリング計測)
+#
+# 使い方: python bench_merge.py [--sizes 10 100 1000 10000] [--output bench_merge.json] [--compare 前回.json]
+#
+# synthetic_diagrams.generate_pair でクラス数ごとに図のペアを作り、フェーズごとの所要時間 (秒) を計測します。
+# 埋め込みにはモデルの代わりに決定的な HashingEncoder を使うので、ネットワークなしで何度でも同じ条件で測れます。
+# 結果は JSON に保存し、--compare で前回の結果と比べた倍率を表示できます。
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+
+import numpy as np
+
+from attribute_similarity import AttributeSimilarities
+from file_io import parse_uml_file, write_uml_file
+from layout import apply_layout
+from main import adjust_layout_with_repulsion, find_best_matches, merge_attributes_with_ai, merge_uml_data
+from multi_merge import diagram_texts
+from offline_encoder import HashingEncoder
+from similarity_calculator import SimilarityCalculator
+from synthetic_diagrams import write_pair
+
+PHASES = ["parse_uml_file", "embedding", "find_best_matches", "merge_attributes_with_ai",
+          "adjust_layout_with_repulsion", "apply_layout", "write_uml_file"]
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+# 全ペア比較・従来の配置調整はこのクラス数までにする（それを超えると遅すぎるため、ブロッキング / null で記録）
+EXHAUSTIVE_LIMIT = 2000
+LEGACY_LAYOUT_LIMIT = 300
+
+
+class _Timer:
+    def __init__(self, phases, name):
+        self.phases, self.name = phases, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.phases[self.name] = time.perf_counter() - self.start
+
+
+def bench_size(n_classes, work_dir, options, candidate_k=20, exhaustive_limit=EXHAUSTIVE_LIMIT,
+               legacy_layout_limit=LEGACY_LAYOUT_LIMIT, seed=0):
+    """n_classes クラスの図のペアで全フェーズを1回ずつ実行し、計測結果の辞書を返します。"""
+    path_a, path_b = os.path.join(work_dir, "a.txt"), os.path.join(work_dir, "b.txt")
+    write_pair(path_a, path_b, n_classes, seed=seed, **options)
+    phases = {}
+    result = {"classes": n_classes, "phases": phases}
+
+    with _Timer(phases, "parse_uml_file"):
+        data_a, data_b = parse_uml_file(path_a), parse_uml_file(path_b)
+    result["relations"] = len(data_a["relations"]) + len(data_b["relations"])
+
+    encoder = HashingEncoder()
+    calculator = SimilarityCalculator("offline-hashing", encoder=encoder)
+    with _Timer(phases, "embedding"):
+        calculator.preload(diagram_texts(data_a) + diagram_texts(data_b))
+    result["texts_embedded"] = encoder.texts_encoded
+
+    k = None if n_classes <= exhaustive_limit else candidate_k
+    result["candidate_k"] = k
+    with _Timer(phases, "find_best_matches"):
+        matches, unmatched_a, unmatched_b, _ = find_best_matches(data_a, data_b, calculator,
+                                                                 collect_all_scores=False, candidate_k=k)
+    result["matches"] = len(matches)
+
+    with _Timer(phases, "merge_attributes_with_ai"):
+        similarities = AttributeSimilarities.from_matches(calculator, matches)
+        for _, _, _, _, _, cls_a, cls_b in matches:
+            merge_attributes_with_ai(cls_a.attributes, cls_b.attributes, calculator,
+                                     similarity=similarities.block(cls_a.attributes, cls_b.attributes))
+
+    # 配置の調整はここでは行わず (iterations=0)、同じマージ結果の複製に対して方法ごとに計測する
+    merged = merge_uml_data(matches, unmatched_a, unmatched_b, data_a, data_b, calculator, layout="vectorized",
+                            layout_options={"iterations": 0}, attribute_similarities=similarities)
+    n_merged = len(merged["classes"])
+    result["merged_classes"] = n_merged
+    if n_merged <= legacy_layout_limit:
+        classes = [type(c)(c.id, c.name, c.attributes, c.x, c.y) for c in merged["classes"]]
+        with _Timer(phases, "adjust_layout_with_repulsion"):
+            adjust_layout_with_repulsion(classes)
+    else:
+        phases["adjust_layout_with_repulsion"] = None
+    classes = [type(c)(c.id, c.name, c.attributes, c.x, c.y) for c in merged["classes"]]
+    with _Timer(phases, "apply_layout"):
+        apply_layout(classes, merged["relations"], "auto")
+
+    with _Timer(phases, "write_uml_file"):
+        write_uml_file(os.path.join(work_dir, "merged.txt"), merged)
+    return result
+
+
+def run(sizes, options, repeat=1, **bench_options):
+    """sizes の各クラス数で bench_size を repeat 回実行し、フェーズごとに最短の時間を残した結果を順に生成します。"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_classes in sizes:
+            best = None
+            for _ in range(repeat):
+                result = bench_size(n_classes, work_dir, options, **bench_options)
+                if best is None:
+                    best = result
+                else:
+                    for phase, seconds in result["phases"].items():
+                        if seconds is not None:
+                            best["phases"][phase] = min(best["phases"][phase], seconds)
+            yield best
+
+
+def compare(results, previous):
+    """前回の結果と同じクラス数・フェーズの時間の倍率 (今回 / 前回) を {クラス数: {フェーズ: 倍率}} で返します。"""
+    before = {r["classes"]: r["phases"] for r in previous["results"]}
+    ratios = {}
+    for r in results:
+        old = before.get(r["classes"], {})
+        ratios[r["classes"]] = {phase: seconds / old[phase] for phase, seconds in r["phases"].items()
+                                if seconds is not None and old.get(phase)}
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成したクラス図でマージ処理の各フェーズの時間を計測します。")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="計測するクラス数")
+    parser.add_argument("--repeat", type=int, default=1, help="クラス数ごとの繰り返し回数（最短の時間を残す）")
+    parser.add_argument("--min-attributes", type=int, default=0)
+    parser.add_argument("--max-attributes", type=int, default=5)
+    parser.add_argument("--relation-density", type=float, default=1.2)
+    parser.add_argument("--overlap", type=float, default=0.8)
+    parser.add_argument("--rename", type=float, default=0.2)
+    parser.add_argument("--candidate-k", type=int, default=20)
+    parser.add_argument("--exhaustive-limit", type=int, default=EXHAUSTIVE_LIMIT)
+    parser.add_argument("--legacy-layout-limit", type=int, default=LEGACY_LAYOUT_LIMIT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_merge.json", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--compare", default=None, help="比較する前回の結果の JSON ファイル")
+    args = parser.parse_args()
+
+    options = {"n_attributes": (args.min_attributes, args.max_attributes), "relation_density": args.relation_density,
+               "overlap": args.overlap, "rename_rate": args.rename}
+    print(f"{'Classes':<9}" + "".join(f"{phase[:14]:>16}" for phase in PHASES))
+    results = []
+    for result in run(args.sizes, options, args.repeat, candidate_k=args.candidate_k,
+                      exhaustive_limit=args.exhaustive_limit, legacy_layout_limit=args.legacy_layout_limit,
+                      seed=args.seed):
+        results.append(result)
+        cells = [result["phases"].get(phase) for phase in PHASES]
+        print(f"{result['classes']:<9}" + "".join(f"{'-':>16}" if s is None else f"{s:>16.4f}" for s in cells))
+
+    report = {"meta": {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                       "numpy": np.__version__, "platform": platform.platform(), "encoder": "HashingEncoder",
+                       "options": dict(options, n_attributes=list(options["n_attributes"]), seed=args.seed,
+                                       candidate_k=args.candidate_k, exhaustive_limit=args.exhaustive_limit,
+                                       legacy_layout_limit=args.legacy_layout_limit, repeat=args.repeat)},
+              "results": results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果を '{args.output}' に保存しました。")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        print(f"\n--- 前回 ({args.compare}) との比較 (今回 / 前回) ---")
+        for n_classes, ratios in compare(results, previous).items():
+            print(f"{n_classes:<9}" + "".join(f"{'-':>16}" if phase not in ratios else f"{ratios[phase]:>15.2f}x"
+                                              for phase in PHASES))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# candidate_index.py (大規模な図のための候補絞り込み: 最近傍インデックスによるブロッキング)
+
+import numpy as np
+
+from matching import Candidates, exact_name_pairs
+from scoring import score_pairs
+
+# 図Bのクラス数がこれ以下なら全件比較、それより多ければ IVF インデックスを使う
+EXACT_SEARCH_LIMIT = 5000
+
+
+def _top_k(similarity, k):
+    """各行の類似度上位 k 件の列番号を返します（順不同）。"""
+    if k >= similarity.shape[1]:
+        return np.broadcast_to(np.arange(similarity.shape[1]), similarity.shape)
+    return np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+
+
+class BruteForceIndex:
+    """正規化済み埋め込みに対して、内積で全件比較する厳密な最近傍検索"""
+    def __init__(self, embeddings, block_size=1024):
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        self.block_size = block_size
+
+    def search(self, queries, k):
+        """各クエリの上位 k 件の添字を (len(queries), min(k, n)) の配列で返します。"""
+        k = min(k, len(self.embeddings))
+        results = np.zeros((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), self.block_size):
+            block = queries[start:start + self.block_size] @ self.embeddings.T
+            results[start:start + len(block)] = _top_k(block, k)
+        return results
+
+
+class IVFIndex:
+    """
+    k-means で埋め込みをクラスタ (リスト) に分け、クエリに近い n_probe 個のリストだけを
+    全件比較する近似最近傍検索 (IVF: inverted file index)。
+    見つかった候補が k 件に満たない場合は -1 で埋めます。
+    """
+    def __init__(self, embeddings, n_lists=None, n_probe=8, iterations=10, seed=0):
+        self.embeddings = np.asarray(embeddings, dtype=np.float32)
+        n = len(self.embeddings)
+        self.n_lists = min(n, n_lists or max(1, int(np.sqrt(n))))
+        self.n_probe = min(n_probe, self.n_lists)
+
+        rng = np.random.default_rng(seed)
+        centroids = self.embeddings[rng.choice(n, self.n_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(self.embeddings @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, self.embeddings)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = np.where(norms > 0, sums / np.where(norms == 0, 1.0, norms), centroids)
+        assignment = np.argmax(self.embeddings @ centroids.T, axis=1)
+
+        self.centroids = centroids
+        # 各リストに属する添字を CSR 形式 (list_ptr, list_members) で持つ
+        self.list_members = np.argsort(assignment, kind='stable')
+        self.list_ptr = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=self.n_lists))])
+
+    def search(self, queries, k):
+        k = min(k, len(self.embeddings))
+        results = np.full((len(queries), k), -1, dtype=np.int64)
+        probes = _top_k(queries @ self.centroids.T, self.n_probe)
+        for q, lists in enumerate(probes):
+            members = np.concatenate([self.list_members[self.list_ptr[l]:self.list_ptr[l + 1]] for l in lists])
+            if len(members) == 0:
+                continue
+            similarity = self.embeddings[members] @ queries[q]
+            top = _top_k(similarity[None, :], min(k, len(members)))[0]
+            results[q, :len(top)] = members[top]
+        return results
+
+
+def build_index(embeddings, exact_limit=EXACT_SEARCH_LIMIT, **ivf_options):
+    """件数が exact_limit 以下なら BruteForceIndex、それより多ければ IVFIndex を作ります。"""
+    if len(embeddings) <= exact_limit:
+        return BruteForceIndex(embeddings)
+    return IVFIndex(embeddings, **ivf_options)
+
+
+def candidate_pairs(features_a, features_b, embeddings_a, embeddings_b, k, exact_limit=EXACT_SEARCH_LIMIT):
+    """
+    図Aの各クラスについて、意味的に近い図Bのクラス上位 k 件と名前が完全一致するクラスを候補とし、
+    重複を除いた (rows, cols) を行優先の順で返します。
+    """
+    n_b = len(features_b)
+    if len(features_a) == 0 or n_b == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    neighbors = build_index(embeddings_b, exact_limit).search(embeddings_a, k)
+    rows = np.repeat(np.arange(len(features_a)), neighbors.shape[1])
+    cols = neighbors.ravel()
+    name_pairs = np.array(exact_name_pairs(features_a.classes, features_b.classes), dtype=np.int64).reshape(-1, 2)
+    keys = np.concatenate([rows[cols >= 0] * n_b + cols[cols >= 0], name_pairs[:, 0] * n_b + name_pairs[:, 1]])
+    keys = np.unique(keys)
+    return keys // n_b, keys % n_b
+
+
+def block_candidates(features_a, features_b, calculator, weights, k, exact_limit=EXACT_SEARCH_LIMIT,
+                     spatial_mode="greedy"):
+    """
+    ブロッキングで絞り込んだペアだけについてスコアを計算し、Candidates を返します。
+    構造・空間スコアの計算量は N×M ではなく約 N×k になります。
+    """
+    embeddings = calculator.encode(features_a.texts + features_b.texts)
+    embeddings_a, embeddings_b = embeddings[:len(features_a)], embeddings[len(features_a):]
+    rows, cols = candidate_pairs(features_a, features_b, embeddings_a, embeddings_b, k, exact_limit)
+    semantic = np.einsum('ij,ij->i', embeddings_a[rows], embeddings_b[cols]).astype(np.float64)
+    blank = ~embeddings.any(axis=1)
+    if blank.any():
+        # 埋め込みのない（ゼロベクトルの）テキストは、同じテキスト同士だけ類似度 1 とする
+        same = [features_a.texts[i] == features_b.texts[j] for i, j in zip(rows, cols)]
+        semantic[blank[:len(features_a)][rows] & blank[len(features_a):][cols] & np.array(same, dtype=bool)] = 1.0
+    structural, spatial, total = score_pairs(features_a, features_b, rows, cols, semantic, weights, spatial_mode)
+    return Candidates(features_a.classes, features_b.classes, rows, cols, semantic, structural, spatial, total)
\ No newline at end of file
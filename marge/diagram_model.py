@@ -0,0 +1,110 @@
+# diagram_model.py (配列ベースのコンパクトなクラス図表現)
+
+import numpy as np
+
+from uml_data import UmlClass, UmlRelation
+
+
+class ColumnarDiagram:
+    """
+    クラス図を列 (カラム) ごとの配列で持つ表現。
+    - クラス: ids / names / attributes のリストと、x / y の int64 配列、ID → 添字の辞書 index
+    - 関連: ids / types / 多重度のリストと、両端のクラスの添字 source_index / target_index
+      （図に存在しないクラスを指す端は -1）
+    - 隣接関係: クラスごとの出る関連・入る関連・隣接クラスを CSR 形式 (ptr, 値の配列) で保持
+    クラスIDは図の中で一意であることを前提にしています。
+    """
+    def __init__(self, class_ids, names, attributes, xs, ys,
+                 relation_ids, source_ids, target_ids, types, source_multis, target_multis):
+        self.class_ids = list(class_ids)
+        self.names = list(names)
+        self.attributes = [tuple(attrs) for attrs in attributes]
+        self.x = np.asarray(xs, dtype=np.int64)
+        self.y = np.asarray(ys, dtype=np.int64)
+        self.index = {class_id: i for i, class_id in enumerate(self.class_ids)}
+
+        self.relation_ids = list(relation_ids)
+        self.source_ids = list(source_ids)
+        self.target_ids = list(target_ids)
+        self.types = list(types)
+        self.source_multiplicities = list(source_multis)
+        self.target_multiplicities = list(target_multis)
+        self.source_index = np.array([self.index.get(s, -1) for s in self.source_ids], dtype=np.int64)
+        self.target_index = np.array([self.index.get(t, -1) for t in self.target_ids], dtype=np.int64)
+        self._build_adjacency()
+
+    @classmethod
+    def from_dict(cls, diagram_data):
+        """parse_uml_file が返す {"classes": [...], "relations": [...]} 形式から作ります。"""
+        classes, relations = diagram_data["classes"], diagram_data["relations"]
+        return cls([c.id for c in classes], [c.name for c in classes], [c.attributes for c in classes],
+                   [c.x for c in classes], [c.y for c in classes],
+                   [r.id for r in relations], [r.source_id for r in relations], [r.target_id for r in relations],
+                   [r.type for r in relations], [r.source_multiplicity for r in relations],
+                   [r.target_multiplicity for r in relations])
+
+    def to_dict(self):
+        """UmlClass / UmlRelation のリストからなる従来の形式に戻します。"""
+        classes = [UmlClass(class_id, name, list(attrs), x, y)
+                   for class_id, name, attrs, x, y in zip(self.class_ids, self.names, self.attributes,
+                                                          self.x.tolist(), self.y.tolist())]
+        relations = [UmlRelation(*fields) for fields in zip(self.relation_ids, self.source_ids, self.target_ids,
+                                                             self.types, self.source_multiplicities,
+                                                             self.target_multiplicities)]
+        return {"classes": classes, "relations": relations}
+
+    @property
+    def n_classes(self):
+        return len(self.class_ids)
+
+    @property
+    def n_relations(self):
+        return len(self.relation_ids)
+
+    @staticmethod
+    def _csr(owners, values, n):
+        """owners[k] ごとに values[k] をまとめた CSR 配列 (ptr, values) を作ります。owners が -1 の要素は除きます。"""
+        valid = owners >= 0
+        owners, values = owners[valid], values[valid]
+        order = np.argsort(owners, kind='stable')
+        ptr = np.concatenate([[0], np.cumsum(np.bincount(owners, minlength=n))]).astype(np.int64)
+        return ptr, values[order]
+
+    def _build_adjacency(self):
+        n = self.n_classes
+        relation_numbers = np.arange(self.n_relations, dtype=np.int64)
+        self.out_ptr, self.out_relations = self._csr(self.source_index, relation_numbers, n)
+        self.in_ptr, self.in_relations = self._csr(self.target_index, relation_numbers, n)
+        self.out_degree = np.diff(self.out_ptr)
+        self.in_degree = np.diff(self.in_ptr)
+
+        # 隣接クラス: 関連の source から見た target と、target から見た source（自己ループは1回だけ）
+        src, dst = self.source_index, self.target_index
+        forward = (src >= 0) & (dst >= 0)
+        backward = forward & (src != dst)
+        owners = np.concatenate([src[forward], dst[backward]])
+        neighbors = np.concatenate([dst[forward], src[backward]])
+        self.neighbor_ptr, self.neighbor_index = self._csr(owners, neighbors, n)
+
+    def outgoing(self, i):
+        """i 番目のクラスが source になっている関連の添字"""
+        return self.out_relations[self.out_ptr[i]:self.out_ptr[i + 1]]
+
+    def incoming(self, i):
+        """i 番目のクラスが target になっている関連の添字"""
+        return self.in_relations[self.in_ptr[i]:self.in_ptr[i + 1]]
+
+    def neighbors(self, i):
+        """i 番目のクラスと関連で結ばれたクラスの添字（関連ごとに1つ、重複あり）"""
+        return self.neighbor_index[self.neighbor_ptr[i]:self.neighbor_ptr[i + 1]]
+
+    def relative_offsets(self):
+        """
+        全クラスの隣接クラスへの相対ベクトル (dx, dy) を、クラスごとに辞書順で並べて返します。
+        戻り値は (ptr, offsets) で、i 番目のクラスの分は offsets[ptr[i]:ptr[i + 1]] です。
+        """
+        owners = np.repeat(np.arange(self.n_classes), np.diff(self.neighbor_ptr))
+        dx = self.x[self.neighbor_index] - self.x[owners]
+        dy = self.y[self.neighbor_index] - self.y[owners]
+        order = np.lexsort((dy, dx, owners))
+        return self.neighbor_ptr, np.stack([dx[order], dy[order]], axis=1)
\ No newline at end of file
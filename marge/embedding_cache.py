@@ -0,0 +1,250 @@
+# embedding_cache.py (埋め込みベクトルの永続キャッシュ)
+
+import hashlib
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows ではファイルロックなしで動作させる
+    fcntl = None
+
+VECTOR_FILE = "vectors.f32"
+INDEX_FILE = "index.npz"
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+
+
+def _slug(model_name):
+    return re.sub(r'[^\w.-]+', '_', model_name)
+
+
+def text_key(text):
+    """テキストのハッシュ (128bit) を (上位64bit, 下位64bit) のタプルで返します。"""
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    return (int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little'))
+
+
+class _FileLock:
+    """fcntl.flock による共有/排他ロック（fcntl がない環境では何もしません）"""
+    def __init__(self, path, exclusive):
+        self.path = path
+        self.exclusive = exclusive
+        self.handle = None
+
+    def __enter__(self):
+        self.handle = open(self.path, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.handle.close()
+
+
+class EmbeddingCache:
+    """
+    モデル名・出力次元・テキストのハッシュをキーにした永続的な埋め込みストア。
+    ベクトルはメモリマップした float32 ファイルに、キー・スロット番号・最終利用時刻は
+    コンパクトなインデックス (npz) に保存します。
+    max_entries を超えると最も長く使われていないエントリのスロットを再利用します。
+    読み込みは共有ロック、書き込みは排他ロックの下で行うため、複数プロセスから同時に読めます。
+    """
+    def __init__(self, cache_dir, model_name, dim, max_entries=200000, read_only=False):
+        self.model_name = model_name
+        self.dim = int(dim)
+        self.max_entries = int(max_entries)
+        self.read_only = read_only
+        self.path = os.path.join(cache_dir, f"{_slug(model_name)}-d{self.dim}")
+        self.hits = 0
+        self.misses = 0
+
+        self._keys = np.zeros((0, 2), dtype=np.uint64)
+        self._slots = np.zeros(0, dtype=np.int64)
+        self._last_used = np.zeros(0, dtype=np.int64)
+        self._lookup = {}
+        self._index_stamp = None
+        self._vectors = None
+        self._touched = {}
+
+        if not read_only:
+            os.makedirs(self.path, exist_ok=True)
+            meta_path = os.path.join(self.path, META_FILE)
+            if not os.path.exists(meta_path):
+                with open(meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({"model_name": model_name, "dim": self.dim}, f, ensure_ascii=False)
+
+    @staticmethod
+    def stored_dims(cache_dir, model_name):
+        """
+        cache_dir に model_name のキャッシュとして保存されている次元を、新しく更新された順に返します。
+        モデルを読み込まずにキャッシュを開くために使います。
+        """
+        prefix = f"{_slug(model_name)}-d"
+        found = []
+        try:
+            entries = os.listdir(cache_dir)
+        except FileNotFoundError:
+            return []
+        for entry in entries:
+            dim = entry[len(prefix):]
+            index_path = os.path.join(cache_dir, entry, INDEX_FILE)
+            if entry.startswith(prefix) and dim.isdigit() and os.path.exists(index_path):
+                found.append((os.path.getmtime(index_path), int(dim)))
+        return [dim for _, dim in sorted(found, reverse=True)]
+
+    def __len__(self):
+        with self._lock(exclusive=False):
+            self._refresh_index()
+            return len(self._slots)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _lock(self, exclusive):
+        return _FileLock(self._file(LOCK_FILE), exclusive)
+
+    def _refresh_index(self):
+        """インデックスファイルが他のプロセスに更新されていれば読み直します。"""
+        index_path = self._file(INDEX_FILE)
+        try:
+            stat = os.stat(index_path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stamp == self._index_stamp:
+            return
+        with np.load(index_path) as index:
+            self._keys = index["keys"]
+            self._slots = index["slots"]
+            self._last_used = index["last_used"]
+        self._lookup = {(int(k[0]), int(k[1])): i for i, k in enumerate(self._keys)}
+        self._index_stamp = stamp
+
+    def _map_vectors(self, min_rows=0):
+        """ベクトルファイルをメモリマップします。ファイルが伸びていれば張り直します。"""
+        vector_path = self._file(VECTOR_FILE)
+        if not os.path.exists(vector_path):
+            self._vectors = None
+            return None
+        rows = os.path.getsize(vector_path) // (4 * self.dim)
+        if self._vectors is None or len(self._vectors) != rows:
+            self._vectors = np.memmap(vector_path, dtype=np.float32, mode='r' if self.read_only else 'r+',
+                                      shape=(rows, self.dim)) if rows else None
+        return self._vectors
+
+    def get_many(self, texts):
+        """
+        キャッシュ済みのテキストについて {テキスト: ベクトル} を返します。
+        見つからなかったテキストは結果に含まれません。
+        """
+        if not os.path.isdir(self.path):
+            self.misses += len(texts)
+            return {}
+        found = {}
+        with self._lock(exclusive=False):
+            self._refresh_index()
+            positions, hit_texts = [], []
+            for text in texts:
+                position = self._lookup.get(text_key(text))
+                if position is None:
+                    continue
+                positions.append(position)
+                hit_texts.append(text)
+            if positions:
+                vectors = self._map_vectors()
+                rows = np.asarray(vectors[self._slots[positions]])
+                found = dict(zip(hit_texts, rows))
+        now = time.time_ns()
+        for text in hit_texts:
+            self._touched[text_key(text)] = now
+        self.hits += len(found)
+        self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, texts, vectors):
+        """テキストとベクトルの組をキャッシュに追加し、インデックスを保存します。"""
+        if self.read_only:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+        with self._lock(exclusive=True):
+            self._refresh_index()
+            new_keys, new_rows, seen = [], [], set()
+            for text, vector in zip(texts, vectors):
+                key = text_key(text)
+                if key in self._lookup or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                new_rows.append(vector)
+            new_keys, new_rows = new_keys[:self.max_entries], new_rows[:self.max_entries]
+            self._apply_touched()
+            if new_keys:
+                self._insert(new_keys, np.stack(new_rows))
+            self._write_index()
+
+    def flush(self):
+        """ヒットしたエントリの最終利用時刻をインデックスに反映します。"""
+        if self.read_only or not self._touched:
+            return
+        with self._lock(exclusive=True):
+            self._refresh_index()
+            self._apply_touched()
+            self._write_index()
+
+    def _apply_touched(self):
+        for key, stamp in self._touched.items():
+            position = self._lookup.get(key)
+            if position is not None:
+                self._last_used[position] = max(self._last_used[position], stamp)
+        self._touched = {}
+
+    def _insert(self, new_keys, new_rows):
+        count = len(self._slots)
+        free = self.max_entries - count
+        evict = max(0, len(new_keys) - free)
+
+        keep = np.ones(count, dtype=bool)
+        reused_slots = np.zeros(0, dtype=np.int64)
+        if evict:
+            # 最終利用時刻が古いものから追い出し、そのスロットを再利用する
+            victims = np.argsort(self._last_used, kind='stable')[:evict]
+            keep[victims] = False
+            reused_slots = self._slots[victims]
+        fresh = len(new_keys) - evict
+        fresh_slots = np.arange(count, count + fresh, dtype=np.int64)
+        slots = np.concatenate([reused_slots, fresh_slots])
+
+        vectors = self._map_vectors()
+        capacity = 0 if vectors is None else len(vectors)
+        needed = count + fresh
+        if needed > capacity:
+            new_capacity = min(self.max_entries, max(needed, capacity * 2, 1024))
+            with open(self._file(VECTOR_FILE), 'ab') as f:
+                f.truncate(new_capacity * self.dim * 4)
+            self._vectors = None
+            vectors = self._map_vectors()
+        vectors[slots] = new_rows
+        vectors.flush()
+
+        stamp = time.time_ns()
+        self._keys = np.concatenate([self._keys[keep], np.array(new_keys, dtype=np.uint64).reshape(-1, 2)])
+        self._slots = np.concatenate([self._slots[keep], slots])
+        self._last_used = np.concatenate([self._last_used[keep], np.full(len(new_keys), stamp, dtype=np.int64)])
+        self._lookup = {(int(k[0]), int(k[1])): i for i, k in enumerate(self._keys)}
+
+    def _write_index(self):
+        """インデックスを一時ファイルに書いてから置き換え、読み手が壊れた状態を見ないようにします。"""
+        index_path = self._file(INDEX_FILE)
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, keys=self._keys, slots=self._slots, last_used=self._last_used)
+        os.replace(tmp_path, index_path)
+        stat = os.stat(index_path)
+        self._index_stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
\ No newline at end of file
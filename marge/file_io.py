@@ -1,100 +1,204 @@
 # file_io.py (関連の書き出し処理を完全に修正)
 
 import re
+from instrumentation import count, phase
 from uml_data import UmlClass, UmlRelation
 
-def parse_uml_file(file_path):
-    # ... (この関数は変更ありません)
+CLASS_PATTERN = re.compile(r"<(\d+)>]Class\$\((\d+),(\d+)\)!(.*?)!(.*);")
+RELATION_PATTERN = re.compile(
+    r"<(\d+)>]ClassRelationLink\$<(\d+)>!<(\d+)>!"
+    r"([^!]*)!!"
+    r"[^!]*![^!]*!"
+    r"([^!]*)!!!"
+    r"[^!]*!"
+    r"([^!]*)!!;"
+)
+
+# 書き出し時、バッファがこの文字数を超えたらファイルに書き込む
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def _parse_record(record):
+    """1レコード分の文字列を UmlClass / UmlRelation に変換します。どちらでもなければ None"""
+    # "<id>]" の直後の種別で、どちらの正規表現を使うかを先に決める
+    tag = record.find(">]")
+    if tag < 0:
+        return None
+    if record.startswith("ClassRelationLink$", tag + 2):
+        relation_match = RELATION_PATTERN.match(record)
+        if relation_match:
+            id, source_id, target_id, rel_type, source_multi, target_multi = relation_match.groups()
+            return UmlRelation(id, source_id, target_id, rel_type, source_multi, target_multi)
+    elif record.startswith("Class$", tag + 2):
+        class_match = CLASS_PATTERN.match(record)
+        if class_match:
+            id, x, y, name, rest = class_match.groups()
+            attributes = []
+            if rest.startswith('!-'):
+                raw_attributes = rest[2:].split('%-')
+                attributes = [attr.rstrip('%!').strip() for attr in raw_attributes if attr.strip()]
+            return UmlClass(id, name, attributes, int(x), int(y))
+    return None
+
+
+def iter_uml_lines(lines):
+    """
+    行のイテラブルからクラス (UmlClass) と関連 (UmlRelation) を順に生成します。
+    write_uml_file の出力のように1行に複数のレコードが連結されている場合も、";<" で区切って読みます。
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if ";<" not in line:
+            item = _parse_record(line)
+            if item is not None:
+                yield item
+            continue
+        records = line.split(";<")
+        for i, record in enumerate(records):
+            if i > 0:
+                record = "<" + record
+            if i < len(records) - 1:
+                record += ";"
+            item = _parse_record(record)
+            if item is not None:
+                yield item
+
+
+def iter_uml_file(file_path):
+    """
+    クラス図ファイルを1行ずつ読みながら、クラスと関連を順に生成します。
+    ファイル全体をメモリに載せないため、大きなファイルにも使えます。
+    ファイルが存在しない場合は FileNotFoundError を送出します。
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        yield from iter_uml_lines(f)
+
+
+def collect_uml(items):
+    """iter_uml_lines / iter_uml_file が生成したクラスと関連を {"classes": [...], "relations": [...]} にまとめます。"""
     classes = []
     relations = []
-    
-    class_pattern = re.compile(r"<(\d+)>]Class\$\((\d+),(\d+)\)!(.*?)!(.*);")
-    relation_pattern = re.compile(
-        r"<(\d+)>]ClassRelationLink\$<(\d+)>!<(\d+)>!"
-        r"([^!]*)!!"
-        r"[^!]*![^!]*!"
-        r"([^!]*)!!!"
-        r"[^!]*!"
-        r"([^!]*)!!;"
-    )
+    for item in items:
+        if isinstance(item, UmlClass):
+            classes.append(item)
+        else:
+            relations.append(item)
+    return {"classes": classes, "relations": relations}
 
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-
-                class_match = class_pattern.match(line)
-                if class_match:
-                    id, x, y, name, rest = class_match.groups()
-                    attributes = []
-                    if rest.startswith('!-'):
-                        attrs_str = rest[2:]
-                        raw_attributes = attrs_str.split('%-')
-                        attributes = [re.sub(r'[%!]+$', '', attr).strip() for attr in raw_attributes if attr.strip()]
-
-                    classes.append(UmlClass(id, name, attributes, int(x), int(y)))
-                    continue
-
-                relation_match = relation_pattern.match(line)
-                if relation_match:
-                    id, source_id, target_id, rel_type, source_multi, target_multi = relation_match.groups()
-                    relations.append(UmlRelation(id, source_id, target_id, rel_type, source_multi, target_multi))
 
+def parse_uml_file(file_path):
+    try:
+        with phase("parse_uml_file"):
+            uml_data = collect_uml(iter_uml_file(file_path))
     except FileNotFoundError:
         print(f"エラー: ファイル '{file_path}' が見つかりません。")
         return None
 
-    return {"classes": classes, "relations": relations}
+    count("records_read", len(uml_data["classes"]) + len(uml_data["relations"]))
+    return uml_data
+
+
+def format_class(uml_class):
+    """クラスを1レコード分の文字列にします。"""
+    if uml_class.attributes:
+        attrs_str = "%-".join(uml_class.attributes)
+        return f"<{uml_class.id}>]Class$({uml_class.x},{uml_class.y})!{uml_class.name}!!-{attrs_str}%!;"
+    return f"<{uml_class.id}>]Class$({uml_class.x},{uml_class.y})!{uml_class.name}!!!;"
+
+
+def format_relation(rel):
+    """関連を1レコード分の文字列にします（描画可能な形式）。"""
+    rel_type = rel.type if rel.type else 'SimpleRelation'
+    source_multi = rel.source_multiplicity if rel.source_multiplicity else 'None'
+    target_multi = rel.target_multiplicity if rel.target_multiplicity else 'None'
+
+    # スタイルと矢印の形状を分離して定義
+    line_style = "Solid"
+    source_arrow = "None"
+    target_arrow = "None" # デフォルト
+
+    if rel_type == "Generalization":
+        target_arrow = "SolidArrow"
+    elif rel_type == "Realization":
+        line_style = "LongDashed"
+        target_arrow = "SolidArrow"
+    elif rel_type == "Dependency":
+        line_style = "Dashed"
+        target_arrow = "WireArrow"
+    elif rel_type == "Aggregation":
+        target_arrow = "SolidDiamond"
+    elif rel_type == "Composition":
+        target_arrow = "InvertedSolidDiamond"
+    elif "Association" in rel_type:
+        target_arrow = "WireArrow"
+
+    # 描画可能なデータの正しい構文に合わせる
+    style_part = f"{line_style}!{source_arrow}"
+
+    return (f"<{rel.id}>]ClassRelationLink$<{rel.source_id}>!<"
+            f"{rel.target_id}>!{rel_type}!!{style_part}!{source_multi}!!!"
+            f"{target_arrow}!{target_multi}!!;")
+
+
+class UmlWriter:
+    """
+    クラスと関連を1つずつ受け取り、buffer_size 文字ごとにまとめてファイルに書き込むライター。
+    write_uml_file と同じバイト列を出力します。
+
+        with UmlWriter("out.txt") as writer:
+            writer.write_classes(classes)
+            writer.write_relations(relations)
+    """
+    def __init__(self, file_path, buffer_size=WRITE_BUFFER_SIZE):
+        self.file_path = file_path
+        self.buffer_size = buffer_size
+        self._file = None
+        self._buffer = []
+        self._buffered = 0
+
+    def __enter__(self):
+        self._file = open(self.file_path, 'w', encoding='utf-8')
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+        self._file.close()
+
+    def _write_records(self, records):
+        buffer, buffered, limit = self._buffer, self._buffered, self.buffer_size
+        for record in records:
+            buffer.append(record)
+            buffered += len(record)
+            if buffered >= limit:
+                self._file.write("".join(buffer))
+                buffer.clear()
+                buffered = 0
+        self._buffered = buffered
+
+    def flush(self):
+        if self._buffer:
+            self._file.write("".join(self._buffer))
+            self._buffer.clear()
+            self._buffered = 0
+
+    def write_class(self, uml_class):
+        self._write_records((format_class(uml_class),))
+
+    def write_relation(self, rel):
+        self._write_records((format_relation(rel),))
+
+    def write_classes(self, classes):
+        self._write_records(map(format_class, classes))
+
+    def write_relations(self, relations):
+        self._write_records(map(format_relation, relations))
 
 
 def write_uml_file(file_path, uml_data):
     """プログラム上のデータをクラス図ファイル形式で書き出す（描画可能な形式に修正）"""
-    lines = []
-    
-    for uml_class in uml_data["classes"]:
-        if uml_class.attributes:
-            attrs_str = "%-".join(uml_class.attributes)
-            line = f"<{uml_class.id}>]Class$({uml_class.x},{uml_class.y})!{uml_class.name}!!-{attrs_str}%!;"
-        else:
-            line = f"<{uml_class.id}>]Class$({uml_class.x},{uml_class.y})!{uml_class.name}!!!;"
-        lines.append(line)
-
-    # ▼▼▼ 修正箇所: 関連の書き出しロジックを全面的に刷新 ▼▼▼
-    for rel in uml_data["relations"]:
-        rel_type = rel.type if rel.type else 'SimpleRelation'
-        source_multi = rel.source_multiplicity if rel.source_multiplicity else 'None'
-        target_multi = rel.target_multiplicity if rel.target_multiplicity else 'None'
-
-        # スタイルと矢印の形状を分離して定義
-        line_style = "Solid"
-        source_arrow = "None"
-        target_arrow = "None" # デフォルト
-
-        if rel_type == "Generalization":
-            target_arrow = "SolidArrow"
-        elif rel_type == "Realization":
-            line_style = "LongDashed"
-            target_arrow = "SolidArrow"
-        elif rel_type == "Dependency":
-            line_style = "Dashed"
-            target_arrow = "WireArrow"
-        elif rel_type == "Aggregation":
-            target_arrow = "SolidDiamond"
-        elif rel_type == "Composition":
-            target_arrow = "InvertedSolidDiamond"
-        elif "Association" in rel_type:
-            target_arrow = "WireArrow"
-        
-        # 描画可能なデータの正しい構文に合わせる
-        style_part = f"{line_style}!{source_arrow}"
-        
-        line = (f"<{rel.id}>]ClassRelationLink$<{rel.source_id}>!<"
-                f"{rel.target_id}>!{rel_type}!!{style_part}!{source_multi}!!!"
-                f"{target_arrow}!{target_multi}!!;")
-        lines.append(line)
-    # ▲▲▲ 修正箇所 ▲▲▲
-
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write("".join(lines))
\ No newline at end of file
+    with phase("write_uml_file"), UmlWriter(file_path) as writer:
+        writer.write_classes(uml_data["classes"])
+        writer.write_relations(uml_data["relations"])
+    count("records_written", len(uml_data["classes"]) + len(uml_data["relations"]))
\ No newline at end of file
@@ -0,0 +1,138 @@
+# incremental.py (前回のマージ結果を保存しておき、変わったクラスの分だけ計算し直す)
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from file_io import format_class, format_relation
+from scoring import score_matrices
+from spatial import spatial_similarity_matrix
+
+STATE_SUFFIX = ".state.npz"
+STATE_VERSION = 1
+
+
+def state_path(output_path):
+    """マージ結果のファイルの隣に置く状態ファイルのパス"""
+    return output_path + STATE_SUFFIX
+
+
+def signature_keys(features):
+    """各クラスの空間シグネチャの内容ハッシュ"""
+    return [hashlib.blake2b(sig.tobytes(), digest_size=16).hexdigest() for sig in features.signatures]
+
+
+def layout_key(classes, relations, layout, layout_options):
+    """配置の調整に入力される内容（クラス・関連・方法・オプション）のハッシュ"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps([layout, layout_options or {}], sort_keys=True).encode('utf-8'))
+    for record in map(format_class, classes):
+        h.update(record.encode('utf-8'))
+    for record in map(format_relation, relations):
+        h.update(record.encode('utf-8'))
+    return h.hexdigest()
+
+
+def _old_positions(ids, keys, old_ids, old_keys):
+    """新しい各クラスについて、ID と内容ハッシュが同じ前回のクラスの添字（なければ -1）を返します。"""
+    old = {class_id: (i, key) for i, (class_id, key) in enumerate(zip(old_ids, old_keys))}
+    positions = np.full(len(ids), -1, dtype=np.int64)
+    for i, (class_id, key) in enumerate(zip(ids, keys)):
+        previous = old.get(class_id)
+        if previous is not None and previous[1] == key:
+            positions[i] = previous[0]
+    return positions
+
+
+class MergeState:
+    """
+    前回の実行の空間スコア行列・マッチ結果・配置を保存し、次の実行で再利用するクラス。
+    - スコア: クラスID と空間シグネチャのハッシュが前回と同じクラス同士の空間スコアは保存した値を使い、
+      変わった（または新しい）クラスの行・列だけを比較し直す。
+      意味スコアは埋め込み（キャッシュ済み）の内積、構造スコアは次数の配列演算なので毎回全体を計算する
+    - 配置: 配置の調整に入力されるマージ後の図が前回と完全に同じときだけ、保存した座標をそのまま使う
+    どの値も全体を計算し直した場合と同じになります。
+    """
+    def __init__(self, path):
+        self.path = path
+        self.stats = {"reused_rows": 0, "reused_cols": 0, "recomputed_pairs": 0, "total_pairs": 0,
+                      "layout_reused": False, "changed_matches": None}
+        self._previous = self._load()
+        self._current = {}
+
+    def _load(self):
+        try:
+            with np.load(self.path) as data:
+                if int(data["version"]) != STATE_VERSION:
+                    return {}
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def score_matrices(self, features_a, features_b, calculator, weights, spatial_mode="greedy"):
+        """scoring.score_matrices と同じ結果を、前回の空間スコアを再利用して計算します。"""
+        ids_a, ids_b = [cls.id for cls in features_a.classes], [cls.id for cls in features_b.classes]
+        keys_a, keys_b = signature_keys(features_a), signature_keys(features_b)
+        previous = self._previous
+        if "spatial" in previous and str(previous["spatial_mode"]) == spatial_mode:
+            old_rows = _old_positions(ids_a, keys_a, previous["ids_a"].tolist(), previous["keys_a"].tolist())
+            old_cols = _old_positions(ids_b, keys_b, previous["ids_b"].tolist(), previous["keys_b"].tolist())
+        else:
+            old_rows = np.full(len(ids_a), -1, dtype=np.int64)
+            old_cols = np.full(len(ids_b), -1, dtype=np.int64)
+
+        kept_rows, new_rows = np.flatnonzero(old_rows >= 0), np.flatnonzero(old_rows < 0)
+        kept_cols, new_cols = np.flatnonzero(old_cols >= 0), np.flatnonzero(old_cols < 0)
+        spatial = np.empty((len(ids_a), len(ids_b)))
+        if len(kept_rows) and len(kept_cols):
+            spatial[np.ix_(kept_rows, kept_cols)] = previous["spatial"][np.ix_(old_rows[kept_rows],
+                                                                               old_cols[kept_cols])]
+        if len(new_rows):
+            spatial[new_rows] = spatial_similarity_matrix([features_a.signatures[i] for i in new_rows],
+                                                          features_b.signatures, spatial_mode)
+        if len(kept_rows) and len(new_cols):
+            spatial[np.ix_(kept_rows, new_cols)] = spatial_similarity_matrix(
+                [features_a.signatures[i] for i in kept_rows],
+                [features_b.signatures[j] for j in new_cols], spatial_mode)
+
+        self.stats.update(reused_rows=len(kept_rows), reused_cols=len(kept_cols),
+                          total_pairs=len(ids_a) * len(ids_b),
+                          recomputed_pairs=len(ids_a) * len(ids_b) - len(kept_rows) * len(kept_cols))
+        self._current.update(spatial_mode=np.array(spatial_mode), spatial=spatial,
+                             ids_a=np.array(ids_a, dtype=str), ids_b=np.array(ids_b, dtype=str),
+                             keys_a=np.array(keys_a, dtype=str), keys_b=np.array(keys_b, dtype=str))
+        return score_matrices(features_a, features_b, calculator, weights, spatial_mode, spatial=spatial)
+
+    def record_matches(self, matches):
+        """マッチ結果 (A のID, B のID) を記録し、前回から変わったペアの数を数えます。"""
+        pairs = sorted((cls_a.id, cls_b.id) for _, _, _, _, _, cls_a, cls_b in matches)
+        if "matches" in self._previous:
+            previous = {tuple(pair) for pair in self._previous["matches"].tolist()}
+            self.stats["changed_matches"] = len(previous.symmetric_difference(pairs))
+        self._current["matches"] = np.array(pairs, dtype=str).reshape(-1, 2)
+
+    def layout(self, classes, relations, layout, layout_options, run_layout):
+        """
+        run_layout(classes) で配置を調整した classes を返します。
+        入力が前回と同じであれば run_layout は呼ばずに、保存した座標を書き戻します。
+        """
+        key = layout_key(classes, relations, layout, layout_options)
+        previous = self._previous
+        if "layout_key" in previous and str(previous["layout_key"]) == key and len(previous["layout_x"]) == len(classes):
+            for cls, x, y in zip(classes, previous["layout_x"].tolist(), previous["layout_y"].tolist()):
+                cls.x, cls.y = x, y
+            self.stats["layout_reused"] = True
+        else:
+            classes = run_layout(classes)
+        self._current.update(layout_key=np.array(key), layout_x=np.array([cls.x for cls in classes]),
+                             layout_y=np.array([cls.y for cls in classes]))
+        return classes
+
+    def save(self):
+        """今回の結果を状態ファイルに書き出します（一時ファイルから置き換えるので途中で壊れません）。"""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, version=np.array(STATE_VERSION), **self._current)
+        os.replace(temp_path, self.path)
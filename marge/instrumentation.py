@@ -0,0 +1,153 @@
+# instrumentation.py (フェーズごとの時間・カウンターの計測とフック)
+#
+# 計測したい処理は phase("名前") の with ブロックで囲み、件数は count / sample で記録します。
+# フックが1つも登録されていなければ何も記録しないので、普段の実行にはほとんど影響しません。
+#
+#     with profile() as profiler:
+#         main()
+#     profiler.write_json("run_report.json")
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows ではピークメモリを記録しない
+    resource = None
+
+_hooks = []
+
+
+def add_hook(hook):
+    """hook(kind, name, value) を登録します。kind は "phase"（value は秒）・"count"・"sample" のいずれかです。"""
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def active():
+    """フックが登録されているか"""
+    return bool(_hooks)
+
+
+def emit(kind, name, value):
+    for hook in list(_hooks):
+        hook(kind, name, value)
+
+
+def count(name, value=1):
+    """カウンター name に value を加えます（エンコードの呼び出し回数・キャッシュのヒット数など）。"""
+    if _hooks:
+        emit("count", name, value)
+
+
+def sample(name, value):
+    """name の値の分布に value を加えます（バッチサイズなど）。"""
+    if _hooks:
+        emit("sample", name, value)
+
+
+class _Phase:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if _hooks:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            emit("phase", self.name, time.perf_counter() - self.start)
+
+
+def phase(name):
+    """with phase("名前"): で囲んだ処理の経過時間を記録します。入れ子にした場合はそれぞれの時間を記録します。"""
+    return _Phase(name)
+
+
+def peak_memory_mb():
+    """このプロセスのこれまでの最大常駐メモリ (MB)。取得できない環境では None を返します。"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+class Profiler:
+    """
+    イベントを集計するフック。
+    - phases: フェーズごとの合計時間・回数と、フェーズ終了時点までのピークメモリ
+    - counters: カウンターの合計
+    - samples: 値の分布（件数・最小・最大・平均）
+    """
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+        self.samples = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, kind, name, value):
+        with self._lock:
+            if kind == "phase":
+                entry = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0, "peak_memory_mb": None})
+                entry["seconds"] += value
+                entry["calls"] += 1
+                entry["peak_memory_mb"] = peak_memory_mb()
+            elif kind == "count":
+                self.counters[name] = self.counters.get(name, 0) + value
+            elif kind == "sample":
+                self.samples.setdefault(name, []).append(value)
+
+    def report(self):
+        """集計結果を JSON に書き出せる辞書で返します。"""
+        with self._lock:
+            samples = {name: {"count": len(values), "min": min(values), "max": max(values),
+                              "mean": sum(values) / len(values)}
+                       for name, values in self.samples.items()}
+            return {"total_seconds": time.perf_counter() - self.started,
+                    "peak_memory_mb": peak_memory_mb(),
+                    "phases": {name: dict(entry) for name, entry in self.phases.items()},
+                    "counters": dict(self.counters),
+                    "samples": samples}
+
+    def write_json(self, file_path):
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+    def summary_lines(self, top_k=10):
+        """時間のかかったフェーズ上位 top_k 件と主なカウンターを、表示用の行のリストで返します。"""
+        report = self.report()
+        lines = [f"{'Phase':<28}{'Seconds':>10}{'Calls':>7}"]
+        ranked = sorted(report["phases"].items(), key=lambda item: item[1]["seconds"], reverse=True)
+        for name, entry in ranked[:top_k]:
+            lines.append(f"{name:<28}{entry['seconds']:>10.4f}{entry['calls']:>7}")
+        if len(ranked) > top_k:
+            lines.append(f"... 他 {len(ranked) - top_k} フェーズ")
+        if report["counters"]:
+            lines.append(", ".join(f"{name}={value}" for name, value in sorted(report["counters"].items())))
+        if report["peak_memory_mb"] is not None:
+            lines.append(f"ピークメモリ: {report['peak_memory_mb']:.1f} MB")
+        return lines
+
+
+@contextmanager
+def profile(profiler=None):
+    """with profile() as profiler: の間だけ Profiler をフックとして登録します。"""
+    profiler = profiler or Profiler()
+    add_hook(profiler)
+    try:
+        yield profiler
+    finally:
+        remove_hook(profiler)
@@ -0,0 +1,173 @@
+# layout.py (マージ後のクラス配置を整える力学モデルのレイアウトエンジン)
+
+import numpy as np
+
+LAYOUT_MODES = ("legacy", "vectorized", "barnes_hut", "auto")
+
+# auto モードでクラス数がこれ以上なら Barnes-Hut 近似を使う
+BARNES_HUT_MIN_CLASSES = 1500
+
+# 四分木の最大の深さ（座標を 2**16 段階に量子化する）
+QUADTREE_MAX_DEPTH = 16
+
+
+def repulsion_all_pairs(positions, k_repulsion, block_size=1024):
+    """全ペアの斥力 (k / d^2) を配列演算で計算します。メモリを抑えるため block_size 行ずつ処理します。"""
+    n = len(positions)
+    forces = np.zeros((n, 2))
+    for start in range(0, n, block_size):
+        block = positions[start:start + block_size]
+        dx = block[:, None, 0] - positions[None, :, 0]
+        dy = block[:, None, 1] - positions[None, :, 1]
+        distance_sq = np.maximum(dx**2 + dy**2, 1)
+        scale = k_repulsion / (distance_sq * np.sqrt(distance_sq))
+        # 自分自身との組は dx = dy = 0 なので力は 0 になる
+        forces[start:start + len(block), 0] = (scale * dx).sum(axis=1)
+        forces[start:start + len(block), 1] = (scale * dy).sum(axis=1)
+    return forces
+
+
+def _spread_bits(v):
+    v = v & 0xFFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+
+def _quadtree_levels(positions, max_depth):
+    """
+    座標をモートン符号に変換し、深さごとのセル (キー・質量・重心) を配列で作ります。
+    深さ L のセルのキーは符号の上位 2L ビットで、子セルのキーは 4*key .. 4*key+3 になります。
+    """
+    low = positions.min(axis=0)
+    size = max(float((positions.max(axis=0) - low).max()), 1.0) * (1 + 1e-9)
+    cells = 1 << max_depth
+    q = np.minimum(((positions - low) / size * cells).astype(np.int64), cells - 1)
+    codes = _spread_bits(q[:, 0]) | (_spread_bits(q[:, 1]) << 1)
+
+    levels = []
+    for level in range(max_depth + 1):
+        keys, inverse, mass = np.unique(codes >> (2 * (max_depth - level)),
+                                        return_inverse=True, return_counts=True)
+        com_x = np.bincount(inverse, weights=positions[:, 0]) / mass
+        com_y = np.bincount(inverse, weights=positions[:, 1]) / mass
+        levels.append((keys, inverse, mass, com_x, com_y, size / (1 << level)))
+    return levels
+
+
+def repulsion_barnes_hut(positions, k_repulsion, theta=0.5, max_depth=QUADTREE_MAX_DEPTH):
+    """
+    Barnes-Hut 近似による斥力。四分木のセルが十分遠い (幅 / 距離 < theta) ときは
+    セル内のクラスをまとめて重心にある1つの質点として扱います。
+    全クラスについての木の探索を (クラス, セル) の組の配列として深さごとにまとめて進めます。
+    """
+    n = len(positions)
+    forces = np.zeros((n, 2))
+    if n < 2:
+        return forces
+    levels = _quadtree_levels(positions, max_depth)
+
+    bodies = np.arange(n)
+    nodes = np.zeros(n, dtype=np.int64)
+    for level, (keys, inverse, mass, com_x, com_y, width) in enumerate(levels):
+        if len(bodies) == 0:
+            break
+        node_mass = mass[nodes].astype(np.float64)
+        cx, cy = com_x[nodes], com_y[nodes]
+        contains_self = inverse[bodies] == nodes
+        if level == len(levels) - 1:
+            # 最深部のセルに自分が含まれる場合は、自分を除いた重心を使う
+            others = node_mass - contains_self
+            keep = others > 0
+            px, py = positions[bodies, 0], positions[bodies, 1]
+            cx = np.where(contains_self & keep, (cx * node_mass - px) / np.maximum(others, 1), cx)
+            cy = np.where(contains_self & keep, (cy * node_mass - py) / np.maximum(others, 1), cy)
+            accept, node_mass = keep, others
+        else:
+            distance_sq = (positions[bodies, 0] - cx)**2 + (positions[bodies, 1] - cy)**2
+            far = width * width < theta * theta * distance_sq
+            accept = ~contains_self & (far | (node_mass == 1))
+
+        if accept.any():
+            b = bodies[accept]
+            dx, dy = positions[b, 0] - cx[accept], positions[b, 1] - cy[accept]
+            distance_sq = np.maximum(dx**2 + dy**2, 1)
+            scale = node_mass[accept] * k_repulsion / (distance_sq * np.sqrt(distance_sq))
+            forces[:, 0] += np.bincount(b, weights=scale * dx, minlength=n)
+            forces[:, 1] += np.bincount(b, weights=scale * dy, minlength=n)
+
+        if level == len(levels) - 1:
+            break
+        # 受け入れなかった組は子セルに展開する（自分だけのセルは捨てる）
+        expand = ~accept & ~(contains_self & (node_mass == 1))
+        bodies, parents = bodies[expand], keys[nodes[expand]]
+        child_keys = levels[level + 1][0]
+        first = np.searchsorted(child_keys, parents * 4)
+        count = np.searchsorted(child_keys, parents * 4 + 4) - first
+        bodies = np.repeat(bodies, count)
+        offsets = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        nodes = np.repeat(first, count) + offsets
+    return forces
+
+
+def attraction_forces(positions, edges, k_attraction, spring_length):
+    """関連で結ばれたクラス同士を、距離 spring_length に近づけるばねの力"""
+    forces = np.zeros_like(positions)
+    if len(edges) == 0 or k_attraction == 0:
+        return forces
+    i, j = edges[:, 0], edges[:, 1]
+    dx = positions[j, 0] - positions[i, 0]
+    dy = positions[j, 1] - positions[i, 1]
+    distance = np.sqrt(dx**2 + dy**2)
+    scale = k_attraction * (distance - spring_length) / np.maximum(distance, 1e-9)
+    scale = np.where(distance > 0, scale, 0.0)
+    n = len(positions)
+    for axis, delta in ((0, dx), (1, dy)):
+        forces[:, axis] += np.bincount(i, weights=scale * delta, minlength=n)
+        forces[:, axis] -= np.bincount(j, weights=scale * delta, minlength=n)
+    return forces
+
+
+def compute_layout(positions, edges=None, mode="auto", k_repulsion=20000, iterations=100,
+                   tolerance=0, k_attraction=0.0, spring_length=200.0, theta=0.5):
+    """
+    整数座標 (n, 2) に力学モデルを適用し、(新しい座標, 実行した反復回数) を返します。
+    すべてのクラスの力を同じ座標から計算してから一斉に動かす（同期更新）ため、結果はクラスの順序に依存しません。
+    各クラスの移動量は adjust_layout_with_repulsion と同じく int(力 / 10) で、
+    全クラスの移動量が tolerance 以下になった時点で打ち切ります。
+    """
+    if mode not in LAYOUT_MODES or mode == "legacy":
+        raise ValueError(f"compute_layout では使えないレイアウト方式です: {mode}")
+    positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2).copy()
+    edges = np.zeros((0, 2), dtype=np.int64) if edges is None else np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    if mode == "auto":
+        mode = "barnes_hut" if len(positions) >= BARNES_HUT_MIN_CLASSES else "vectorized"
+
+    for iteration in range(1, iterations + 1):
+        current = positions.astype(np.float64)
+        if mode == "barnes_hut":
+            forces = repulsion_barnes_hut(current, k_repulsion, theta)
+        else:
+            forces = repulsion_all_pairs(current, k_repulsion)
+        forces += attraction_forces(current, edges, k_attraction, spring_length)
+        step = np.trunc(forces / 10).astype(np.int64)
+        positions += step
+        if len(step) == 0 or np.abs(step).max() <= tolerance:
+            return positions, iteration
+    return positions, iterations
+
+
+def apply_layout(classes, relations=None, mode="auto", **options):
+    """
+    compute_layout の結果を UmlClass の x, y に書き戻します。
+    k_attraction を指定した場合は relations の両端のクラスを引き寄せます。
+    """
+    index = {cls.id: i for i, cls in enumerate(classes)}
+    edges = [(index[rel.source_id], index[rel.target_id]) for rel in relations or []
+             if rel.source_id in index and rel.target_id in index and rel.source_id != rel.target_id]
+    positions, _ = compute_layout([(cls.x, cls.y) for cls in classes], edges, mode, **options)
+    for cls, (x, y) in zip(classes, positions.tolist()):
+        cls.x, cls.y = x, y
+    return classes
\ No newline at end of file
@@ -1,9 +1,19 @@
 # main.py (関連の重複マージロジックを修正した最終版)
 
+import argparse
 import math
 import re
+
+import numpy as np
 from file_io import parse_uml_file, write_uml_file
 from similarity_calculator import SimilarityCalculator
+from scoring import DEFAULT_WEIGHTS, DiagramFeatures, compare_signatures, score_matrices
+from matching import Candidates, select_matches
+from candidate_index import block_candidates
+from layout import apply_layout
+from attribute_similarity import AttributeSimilarities
+from incremental import MergeState, state_path
+from instrumentation import phase, profile
 from uml_data import UmlClass, UmlRelation
 
 # --- 類似度計算関数群 (変更なし) ---
@@ -43,79 +53,105 @@ def get_spatial_signature(cls, diagram_data):
     signature.sort()
     return signature
 
-def compare_signatures(sig_a, sig_b):
-    if not sig_a and not sig_b: return 1.0
-    if not sig_a or not sig_b: return 0.0
-    def vector_distance(v1, v2):
-        return math.sqrt((v1[0] - v2[0])**2 + (v1[1] - v2[1])**2)
-    total_distance = 0
-    matched_b_indices = set()
-    for vec_a in sig_a:
-        min_dist = float('inf')
-        best_match_idx = -1
-        for i, vec_b in enumerate(sig_b):
-            if i in matched_b_indices: continue
-            dist = vector_distance(vec_a, vec_b)
-            if dist < min_dist:
-                min_dist = dist
-                best_match_idx = i
-        if best_match_idx != -1:
-            total_distance += min_dist
-            matched_b_indices.add(best_match_idx)
-    avg_distance = total_distance / len(sig_a) if sig_a else 0
-    similarity = 1 / (1 + avg_distance / 100)
-    len_diff_penalty = 1.0 - (abs(len(sig_a) - len(sig_b)) / max(len(sig_a), len(sig_b)))
-    return similarity * len_diff_penalty
-
 def calculate_spatial_similarity_advanced(cls_a, data_a, cls_b, data_b):
     signature_a = get_spatial_signature(cls_a, data_a)
     signature_b = get_spatial_signature(cls_b, data_b)
     return compare_signatures(signature_a, signature_b)
 
-# --- find_best_matches (変更なし) ---
-def find_best_matches(data_a, data_b, calculator, threshold=0.6, weights=None):
+# --- find_best_matches ---
+def find_best_matches(data_a, data_b, calculator, threshold=0.6, weights=None,
+                      strategy="greedy", collect_all_scores=True, candidate_k=None,
+                      spatial_matching="greedy", state=None, score_limit=None):
+    """
+    図Aと図Bのクラスを対応付けます。
+    strategy="greedy" は従来の3パス貪欲法、"optimal" は名前一致・高い意味的類似度のペアを固定したうえで
+    合計スコアが threshold 以上の候補から最適な割り当てを求めます。
+    candidate_k を指定すると、A の各クラスについて意味的に近い B のクラス上位 candidate_k 件と
+    名前が一致するクラスだけをスコア計算の対象にします（大規模な図向けのブロッキング）。
+    spatial_matching="optimal" にすると、空間シグネチャのベクトル同士を距離の合計が最小になるように対応付けます。
+    collect_all_scores=False の場合、全ペアのタプルのリスト (all_scores) は作らずに None を返します。
+    ブロッキング時の all_scores は候補ペアの分だけになります。
+    state (incremental.MergeState) を渡すと、前回の実行から変わっていないクラス同士の空間スコアを再利用します。
+    score_limit を指定すると、all_scores には合計スコアの上位 score_limit 件だけを入れます。
+    """
     if weights is None:
-        weights = {"semantic": 0.7, "relational": 0.0, "structural": 0.15, "spatial": 0.15}
+        weights = DEFAULT_WEIGHTS
     classes_a, classes_b = list(data_a["classes"]), list(data_b["classes"])
-    all_scores = []
-    for cls_a in classes_a:
-        for cls_b in classes_b:
-            text_a = f"{cls_a.name} {' '.join(cls_a.attributes)}"
-            text_b = f"{cls_b.name} {' '.join(cls_b.attributes)}"
-            semantic_score = calculator.get_similarity(text_a, text_b)
-            structural_score = calculate_structural_similarity(cls_a, cls_b, data_a, data_b)
-            spatial_score = calculate_spatial_similarity_advanced(cls_a, data_a, cls_b, data_b)
-            total_score = (semantic_score * weights["semantic"] +
-                           structural_score * weights["structural"] +
-                           spatial_score * weights["spatial"])
-            all_scores.append((total_score, semantic_score, 0.0, structural_score, spatial_score, cls_a, cls_b))
-    all_scores.sort(key=lambda x: x[0], reverse=True)
-    matched_pairs, matched_a_ids, matched_b_ids = [], set(), set()
-    def add_match(score_tuple):
-        cls_a, cls_b = score_tuple[5], score_tuple[6]
-        if cls_a.id not in matched_a_ids and cls_b.id not in matched_b_ids:
-            matched_pairs.append(score_tuple)
-            matched_a_ids.add(cls_a.id)
-            matched_b_ids.add(cls_b.id)
-    for st in all_scores:
-        if st[5].name == st[6].name: add_match(st)
-    for st in all_scores:
-        if st[1] >= 0.95: add_match(st)
-    for st in all_scores:
-        if st[0] >= threshold: add_match(st)
+    # 次数・空間シグネチャは図ごとに1回だけ求め、全ペアのスコアは行列でまとめて計算する
+    with phase("features"):
+        features_a, features_b = DiagramFeatures(data_a), DiagramFeatures(data_b)
+    with phase("scoring"):
+        if candidate_k:
+            scores = None
+            candidates = block_candidates(features_a, features_b, calculator, weights, candidate_k,
+                                          spatial_mode=spatial_matching)
+        else:
+            compute_scores = state.score_matrices if state is not None else score_matrices
+            scores = compute_scores(features_a, features_b, calculator, weights, spatial_matching)
+            candidates = Candidates.from_scores(scores, threshold)
+    with phase("matching"):
+        selected = select_matches(candidates, threshold, strategy)
+
+    matched_pairs = [candidates.score_tuple(k) for k in selected]
+    matched_a_ids = {cls_a.id for _, _, _, _, _, cls_a, _ in matched_pairs}
+    matched_b_ids = {cls_b.id for _, _, _, _, _, _, cls_b in matched_pairs}
     unmatched_a = [cls for cls in classes_a if cls.id not in matched_a_ids]
     unmatched_b = [cls for cls in classes_b if cls.id not in matched_b_ids]
     matched_pairs.sort(key=lambda x: x[0], reverse=True)
+    if state is not None:
+        state.record_matches(matched_pairs)
+
+    all_scores = None
+    if collect_all_scores:
+        if scores is not None:
+            all_scores = scores.rows() if score_limit is None else scores.top_rows(score_limit)
+        else:
+            all_scores = [candidates.score_tuple(k) for k in range(len(candidates))]
+        all_scores.sort(key=lambda x: x[0], reverse=True)
+        if score_limit is not None:
+            del all_scores[max(score_limit, 0):]
     return matched_pairs, unmatched_a, unmatched_b, all_scores
 
-# --- 属性マージと関連マージの関数 (変更なし) ---
-def merge_attributes_with_ai(attrs_a, attrs_b, calculator, perfect_match_threshold=0.98):
+def measure_blocking_recall(data_a, data_b, calculator, candidate_k, threshold=0.6, weights=None,
+                            strategy="greedy"):
+    """
+    ブロッキングあり (candidate_k) と全ペア比較の結果を比べます。
+    candidate_recall: 全ペア比較でマッチしたペアのうち、ブロッキングの候補に含まれていた割合
+    match_recall: 全ペア比較でマッチしたペアのうち、ブロッキングありでも同じくマッチした割合
+    """
+    if weights is None:
+        weights = DEFAULT_WEIGHTS
+    exhaustive = find_best_matches(data_a, data_b, calculator, threshold, weights, strategy,
+                                   collect_all_scores=False)[0]
+    blocked = find_best_matches(data_a, data_b, calculator, threshold, weights, strategy,
+                                collect_all_scores=False, candidate_k=candidate_k)[0]
+    candidates = block_candidates(DiagramFeatures(data_a), DiagramFeatures(data_b), calculator, weights, candidate_k)
+    candidate_ids = {(candidates.classes_a[i].id, candidates.classes_b[j].id)
+                     for i, j in zip(candidates.rows.tolist(), candidates.cols.tolist())}
+    exhaustive_ids = {(m[5].id, m[6].id) for m in exhaustive}
+    blocked_ids = {(m[5].id, m[6].id) for m in blocked}
+    total = max(1, len(exhaustive_ids))
+    return {
+        "candidate_k": candidate_k,
+        "candidate_pairs": len(candidate_ids),
+        "exhaustive_pairs": len(data_a["classes"]) * len(data_b["classes"]),
+        "exhaustive_matches": len(exhaustive_ids),
+        "blocked_matches": len(blocked_ids),
+        "candidate_recall": len(exhaustive_ids & candidate_ids) / total,
+        "match_recall": len(exhaustive_ids & blocked_ids) / total,
+    }
+
+# --- 属性マージと関連マージの関数 ---
+def merge_attributes_with_ai(attrs_a, attrs_b, calculator, perfect_match_threshold=0.98, similarity=None):
+    # similarity に attrs_a × attrs_b の類似度行列 (AttributeSimilarities.block) を渡すとエンコードを省略する
     merged_attrs, matched_b_indices = [], set()
     merged_attrs.extend(attrs_a)
+    if similarity is None:
+        similarity = calculator.get_similarity_matrix(attrs_a, attrs_b)
     for i, attr_a in enumerate(attrs_a):
         for j, attr_b in enumerate(attrs_b):
             if j in matched_b_indices: continue
-            if calculator.get_similarity(attr_a, attr_b) >= perfect_match_threshold:
+            if similarity[i, j] >= perfect_match_threshold:
                 matched_b_indices.add(j)
                 break
     for j, attr_b in enumerate(attrs_b):
@@ -160,13 +196,28 @@ def adjust_layout_with_repulsion(classes, k_repulsion=20000, iterations=100):
     return classes
 
 # ▼▼▼ 関連が重複しないようにマージ関数を修正 ▼▼▼
-def merge_uml_data(matches, unmatched_a, unmatched_b, data_a, data_b, calculator):
+def merge_uml_data(matches, unmatched_a, unmatched_b, data_a, data_b, calculator,
+                   layout="legacy", layout_options=None, attribute_similarities=None, state=None):
+    """
+    マッチ結果に基づいて2つの図をマージします。
+    属性の類似度は attribute_similarities (AttributeSimilarities) から読み出し、
+    省略時は matches の全属性をまとめて1回だけエンコードして作ります。
+    layout はマージ後の配置の調整方法で、"legacy" は adjust_layout_with_repulsion、
+    "vectorized" / "barnes_hut" / "auto" は layout.apply_layout を使います（layout_options はその引数）。
+    state (incremental.MergeState) を渡すと、配置の調整の入力が前回と同じ場合に保存した座標を使います。
+    """
     merged_classes, id_map_a, id_map_b = [], {}, {}
     new_id_counter = 0
 
+    if attribute_similarities is None:
+        with phase("attribute_similarities"):
+            attribute_similarities = AttributeSimilarities.from_matches(calculator, matches)
+
     # 1. クラスのマージ
     for _, _, _, _, _, cls_a, cls_b in matches:
-        merged_attrs = merge_attributes_with_ai(cls_a.attributes, cls_b.attributes, calculator)
+        merged_attrs = merge_attributes_with_ai(
+            cls_a.attributes, cls_b.attributes, calculator,
+            similarity=attribute_similarities.block(cls_a.attributes, cls_b.attributes))
         merged_name = cls_a.name if cls_a.name == cls_b.name else f"{cls_a.name}/{cls_b.name}"
         merged_x, merged_y = (cls_a.x + cls_b.x) // 2, (cls_a.y + cls_b.y) // 2
         
@@ -191,10 +242,11 @@ def merge_uml_data(matches, unmatched_a, unmatched_b, data_a, data_b, calculator
         'Generalization': 2,
         'SimpleRelation': 1
     }
-    all_relations = data_a["relations"] + data_b["relations"]
+    # 図ごとに自分の ID 対応表を使う（関連ごとにリストを線形探索しない）
+    all_relations = [(rel, id_map_a) for rel in data_a["relations"]] + \
+                    [(rel, id_map_b) for rel in data_b["relations"]]
 
-    for rel in all_relations:
-        id_map = id_map_a if rel in data_a["relations"] else id_map_b
+    for rel, id_map in all_relations:
         new_source_id = id_map.get(rel.source_id)
         new_target_id = id_map.get(rel.target_id)
 
@@ -227,40 +279,65 @@ def merge_uml_data(matches, unmatched_a, unmatched_b, data_a, data_b, calculator
         new_id_counter += 1
         merged_relations.append(rel)
     
-    merged_classes = adjust_layout_with_repulsion(merged_classes)
+    def run_layout(classes):
+        if layout == "legacy":
+            return adjust_layout_with_repulsion(classes)
+        return apply_layout(classes, merged_relations, layout, **(layout_options or {}))
+
+    with phase("layout"):
+        if state is not None:
+            merged_classes = state.layout(merged_classes, merged_relations, layout, layout_options, run_layout)
+        else:
+            merged_classes = run_layout(merged_classes)
     return {"classes": merged_classes, "relations": merged_relations}
 # ▲▲▲ 修正箇所ここまで ▲▲▲
 
-# --- 実行部分 (変更なし) ---
-def main():
-    data_a, data_b = parse_uml_file("dataA.txt"), parse_uml_file("dataB.txt")
-    if not (data_a and data_b): return
-    calculator = SimilarityCalculator()
-    if not calculator.model: return
-    matches, unmatched_a, unmatched_b, all_scores = find_best_matches(data_a, data_b, calculator)
-    
-    print("\n--- 全てのクラスペアの類似度スコア一覧 ---")
-    print(f"{'Total':<8}{'Semantic':<10}{'Structural':<12}{'Spatial':<10}{'Class A':<25}{'Class B':<25}")
+# --- 実行部分 ---
+SCORE_HEADER = f"{'Total':<8}{'Semantic':<10}{'Structural':<12}{'Spatial':<10}{'Class A':<25}{'Class B':<25}"
+
+def print_score_rows(rows, total, top_k):
+    """スコアのタプルを上位 top_k 件まで表示し、残りは件数だけを表示します。"""
+    print(SCORE_HEADER)
     print("-" * 85)
-    for score, sem, _, stru, spa, cls_a, cls_b in all_scores:
+    for score, sem, _, stru, spa, cls_a, cls_b in rows[:top_k]:
         print(f"{score:<8.4f}{sem:<10.4f}{stru:<12.4f}{spa:<10.4f}{cls_a.name:<25}{cls_b.name:<25}")
+    if total > top_k:
+        print(f"... 他 {total - top_k} 件")
+
+def run_merge(offline=False, incremental=False, top_k=10):
+    data_a, data_b = parse_uml_file("dataA.txt"), parse_uml_file("dataB.txt")
+    if not (data_a and data_b): return
+    output_filename = "data_merged.txt"
+    # モデルはキャッシュにないテキストが出てきた時点で読み込む（offline=True なら読み込まない）
+    calculator = SimilarityCalculator(cache_dir=".embedding_cache", offline=offline)
+    # incremental=True なら前回の結果 (data_merged.txt.state.npz) から変わっていない部分を再利用する
+    state = MergeState(state_path(output_filename)) if incremental else None
+    with phase("find_best_matches"):
+        matches, unmatched_a, unmatched_b, top_scores = find_best_matches(data_a, data_b, calculator, state=state,
+                                                                          score_limit=top_k)
+    if calculator.load_failed: return
+    n_pairs = len(data_a["classes"]) * len(data_b["classes"])
+
+    print(f"\n--- 類似度スコアの上位 {min(top_k, n_pairs)} 件 (全 {n_pairs} ペア) ---")
+    print_score_rows(top_scores, n_pairs, top_k)
 
     print("\n--- 統合スコアに基づくマッチング候補 ---")
     if matches:
-        print(f"{'Total':<8}{'Semantic':<10}{'Structural':<12}{'Spatial':<10}{'Class A':<25}{'Class B':<25}")
-        print("-" * 85)
-        for score, sem, _, stru, spa, cls_a, cls_b in matches:
-            print(f"{score:<8.4f}{sem:<10.4f}{stru:<12.4f}{spa:<10.4f}{cls_a.name:<25}{cls_b.name:<25}")
+        print_score_rows(matches, len(matches), top_k)
     else:
         print("基準を超えるマッチング候補は見つかりませんでした。")
 
+    # 属性はマッチした全ペア分をまとめて1回だけエンコードし、レポートとマージの両方で使う
+    with phase("attribute_similarities"):
+        attribute_similarities = AttributeSimilarities.from_matches(calculator, matches)
+
     print("\n" + "="*40)
-    print("--- マッチングしたクラスの属性類似度詳細 ---")
+    print(f"--- マッチングしたクラスの属性類似度 (上位 {top_k} ペア × 類似度の高い属性 {top_k} 組) ---")
     print("="*40)
     if not matches:
         print("マッチングされたクラスがありません。")
     else:
-        for score_tuple in matches:
+        for score_tuple in matches[:top_k]:
             cls_a, cls_b = score_tuple[5], score_tuple[6]
             print(f"\n▼ クラスペア: '{cls_a.name}' (A) vs '{cls_b.name}' (B)")
             print("-" * 40)
@@ -268,16 +345,61 @@ def main():
             if not attrs_a or not attrs_b:
                 print("片方または両方のクラスに属性がありません。")
                 continue
-            for attr_a in attrs_a:
-                for attr_b in attrs_b:
-                    similarity = calculator.get_similarity(attr_a, attr_b)
-                    print(f"  類似度 (A:'{attr_a}', B:'{attr_b}') = {similarity:.4f}")
+            similarity = attribute_similarities.block(attrs_a, attrs_b)
+            order = np.argsort(-similarity, axis=None, kind='stable')
+            for k in order[:top_k].tolist():
+                i, j = divmod(k, len(attrs_b))
+                print(f"  類似度 (A:'{attrs_a[i]}', B:'{attrs_b[j]}') = {similarity[i, j]:.4f}")
+            if similarity.size > top_k:
+                print(f"  ... 他 {similarity.size - top_k} 組")
+        if len(matches) > top_k:
+            print(f"\n... 他 {len(matches) - top_k} ペア")
 
     print("\n--- マージ処理を実行中... ---")
-    merged_data = merge_uml_data(matches, unmatched_a, unmatched_b, data_a, data_b, calculator)
-    output_filename = "data_merged.txt"
+    with phase("merge_uml_data"):
+        merged_data = merge_uml_data(matches, unmatched_a, unmatched_b, data_a, data_b, calculator,
+                                     attribute_similarities=attribute_similarities, state=state)
+    # 属性のエンコードで初めてモデルを読み込もうとして失敗した場合も、マージ結果は書き出さない
+    if calculator.load_failed: return
     write_uml_file(output_filename, merged_data)
     print(f"マージが完了し、'{output_filename}' に結果を保存しました。")
+    if state is not None:
+        state.save()
+        stats = state.stats
+        print(f"差分計算: 空間スコア {stats['recomputed_pairs']}/{stats['total_pairs']} ペアを再計算"
+              f"（再利用 A {stats['reused_rows']} 行 × B {stats['reused_cols']} 列）、"
+              f"配置 {'再利用' if stats['layout_reused'] else '再計算'}")
+    calculator.close()
+    print(f"埋め込みキャッシュ: ヒット {calculator.cache_hits} 件 / ミス {calculator.cache_misses} 件")
+    if not calculator.model_loaded:
+        print(f"モデルは読み込まずに完了しました（埋め込みのないテキスト {calculator.unembedded} 件）。")
+
+def main(offline=False, incremental=False, top_k=10, report_path=None):
+    """
+    dataA.txt と dataB.txt をマージして data_merged.txt に保存し、上位 top_k 件ずつの要約を表示します。
+    report_path を指定すると、フェーズごとの時間・エンコード回数・キャッシュのヒット数などを JSON で書き出します。
+    """
+    with profile() as profiler:
+        run_merge(offline, incremental, top_k)
+    print("\n--- 実行時間の内訳 ---")
+    for line in profiler.summary_lines(top_k):
+        print(line)
+    if report_path:
+        profiler.write_json(report_path)
+        print(f"実行レポートを '{report_path}' に保存しました。")
+
+def non_negative_int(value):
+    """argparse の type 用。0 以上の整数だけを受け付けます。"""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"0 以上の整数を指定してください: {value}")
+    return number
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="dataA.txt と dataB.txt のクラス図をマージします。")
+    parser.add_argument("--offline", action="store_true", help="モデルを読み込まず、キャッシュ済みの埋め込みだけを使う")
+    parser.add_argument("--incremental", action="store_true", help="前回の結果から変わっていない部分を再利用する")
+    parser.add_argument("--top-k", type=non_negative_int, default=10, help="表示するスコア・ペア・属性の件数")
+    parser.add_argument("--report", default=None, help="実行レポートを書き出す JSON ファイル")
+    args = parser.parse_args()
+    main(args.offline, args.incremental, args.top_k, args.report)
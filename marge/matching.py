@@ -0,0 +1,136 @@
+# matching.py (スコアからクラスの対応付けを決めるマッチング戦略)
+
+import numpy as np
+
+# 意味的類似度がこの値以上のペアは、完全一致の名前と同様に確定させる
+SEMANTIC_PIN_THRESHOLD = 0.95
+
+
+class Candidates:
+    """
+    マッチング候補となるクラスペアの疎な集合 (COO形式)。
+    rows / cols は図A・図Bのクラスの添字で、行優先 (A の順 × B の順) に並べておきます。
+    """
+    def __init__(self, classes_a, classes_b, rows, cols, semantic, structural, spatial, total):
+        self.classes_a = classes_a
+        self.classes_b = classes_b
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.semantic = np.asarray(semantic, dtype=np.float64)
+        self.structural = np.asarray(structural, dtype=np.float64)
+        self.spatial = np.asarray(spatial, dtype=np.float64)
+        self.total = np.asarray(total, dtype=np.float64)
+        # クラス名を整数コードに置き換えて、名前の一致を配列の比較で判定する
+        codes = {}
+        codes_a = np.array([codes.setdefault(c.name, len(codes)) for c in classes_a], dtype=np.int64)
+        codes_b = np.array([codes.setdefault(c.name, len(codes)) for c in classes_b], dtype=np.int64)
+        self.same_name = (codes_a[self.rows] == codes_b[self.cols]) if len(self.rows) else np.zeros(0, dtype=bool)
+
+    @classmethod
+    def from_scores(cls, scores, threshold):
+        """
+        ScoreMatrices から、いずれかのパスで採用されうるペア
+        （名前が完全一致・意味的類似度が SEMANTIC_PIN_THRESHOLD 以上・合計が threshold 以上）だけを取り出します。
+        """
+        keep = (scores.total >= threshold) | (scores.semantic >= SEMANTIC_PIN_THRESHOLD)
+        for i, j in exact_name_pairs(scores.classes_a, scores.classes_b):
+            keep[i, j] = True
+        rows, cols = np.nonzero(keep)
+        return cls(scores.classes_a, scores.classes_b, rows, cols,
+                   scores.semantic[rows, cols], scores.structural[rows, cols],
+                   scores.spatial[rows, cols], scores.total[rows, cols])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def score_tuple(self, k):
+        """k 番目の候補を all_scores と同じ形式のタプルにします。"""
+        return (float(self.total[k]), float(self.semantic[k]), 0.0, float(self.structural[k]),
+                float(self.spatial[k]), self.classes_a[self.rows[k]], self.classes_b[self.cols[k]])
+
+
+def exact_name_pairs(classes_a, classes_b):
+    """名前が完全一致する (i, j) の組を、ハッシュ結合で列挙します。"""
+    names_b = {}
+    for j, cls in enumerate(classes_b):
+        names_b.setdefault(cls.name, []).append(j)
+    return [(i, j) for i, cls in enumerate(classes_a) for j in names_b.get(cls.name, [])]
+
+
+def _sweep(candidates, order, mask, used_a, used_b, selected):
+    """スコアの高い順に、まだ使われていない A・B のクラス同士のペアを採用していきます。"""
+    for k in order[mask[order]]:
+        i, j = candidates.rows[k], candidates.cols[k]
+        if not used_a[i] and not used_b[j]:
+            used_a[i] = used_b[j] = True
+            selected.append(k)
+
+
+def _pin(candidates):
+    """名前の完全一致と高い意味的類似度のペアを確定させます（どの戦略でも共通の制約）。"""
+    order = np.argsort(-candidates.total, kind='stable')
+    used_a = np.zeros(len(candidates.classes_a), dtype=bool)
+    used_b = np.zeros(len(candidates.classes_b), dtype=bool)
+    selected = []
+    _sweep(candidates, order, candidates.same_name, used_a, used_b, selected)
+    _sweep(candidates, order, candidates.semantic >= SEMANTIC_PIN_THRESHOLD, used_a, used_b, selected)
+    return order, used_a, used_b, selected
+
+
+def greedy_match(candidates, threshold):
+    """従来の3パス貪欲法: 名前一致 → 意味的類似度 >= 0.95 → 合計スコア >= threshold"""
+    order, used_a, used_b, selected = _pin(candidates)
+    _sweep(candidates, order, candidates.total >= threshold, used_a, used_b, selected)
+    return selected
+
+
+def optimal_match(candidates, threshold):
+    """
+    名前一致と高い意味的類似度のペアを固定したうえで、残りのクラスについて
+    合計スコア >= threshold の候補だけを辺とする二部グラフの最大重みマッチングを求めます。
+    候補グラフを連結成分に分け、成分ごとに linear_sum_assignment (Jonker-Volgenant) を解くため、
+    候補が疎であれば N×M の密行列を作りません。
+    """
+    from scipy.optimize import linear_sum_assignment
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    order, used_a, used_b, selected = _pin(candidates)
+    edges = np.flatnonzero((candidates.total >= threshold) &
+                           ~used_a[candidates.rows] & ~used_b[candidates.cols])
+    if len(edges) == 0:
+        return selected
+
+    n_a = len(candidates.classes_a)
+    rows, cols = candidates.rows[edges], candidates.cols[edges]
+    n_nodes = n_a + len(candidates.classes_b)
+    graph = coo_matrix((np.ones(len(edges)), (rows, n_a + cols)), shape=(n_nodes, n_nodes))
+    _, labels = connected_components(graph, directed=False)
+
+    edge_labels = labels[rows]
+    for label in np.unique(edge_labels):
+        members = edges[edge_labels == label]
+        comp_rows, row_pos = np.unique(candidates.rows[members], return_inverse=True)
+        comp_cols, col_pos = np.unique(candidates.cols[members], return_inverse=True)
+        benefit = np.zeros((len(comp_rows), len(comp_cols)))
+        edge_at = np.full((len(comp_rows), len(comp_cols)), -1, dtype=np.int64)
+        benefit[row_pos, col_pos] = candidates.total[members]
+        edge_at[row_pos, col_pos] = members
+        assigned_rows, assigned_cols = linear_sum_assignment(benefit, maximize=True)
+        for r, c in zip(assigned_rows, assigned_cols):
+            if edge_at[r, c] >= 0:
+                selected.append(int(edge_at[r, c]))
+    return selected
+
+
+MATCHING_STRATEGIES = {
+    "greedy": greedy_match,
+    "optimal": optimal_match,
+}
+
+
+def select_matches(candidates, threshold, strategy="greedy"):
+    """strategy で指定した方法でマッチングし、採用した候補の添字のリストを返します。"""
+    if strategy not in MATCHING_STRATEGIES:
+        raise ValueError(f"未知のマッチング戦略です: {strategy} (選択肢: {', '.join(MATCHING_STRATEGIES)})")
+    return MATCHING_STRATEGIES[strategy](candidates, threshold)
\ No newline at end of file
@@ -0,0 +1,295 @@
+# merge_server.py (モデルを読み込んだまま常駐し、ローカルからのマージ要求に答えるサーバー)
+#
+# 使い方: python merge_server.py [--port 8765] [--unix /tmp/marge.sock]
+#
+# localhost の HTTP (または Unix ソケット上の HTTP) で、JSON を POST して使います。
+#   POST /merge       {"a": 図Aの内容, "b": 図Bの内容, "threshold": 0.6, "weights": {...},
+#                      "strategy": "greedy", "layout": "legacy"}  → {"merged": マージ結果の内容, ...}
+#   POST /match       /merge と同じ入力 → {"matches": [...], "unmatched_a": [...], "unmatched_b": [...]}
+#   POST /similarity  {"texts_a": [...], "texts_b": [...]} → {"matrix": [[...], ...]}
+#   GET  /stats       → 処理件数などの統計
+# 図の内容はクラス図ファイルと同じ形式の文字列です。
+#
+# 短い時間 (batch_window 秒) の間に届いた要求のテキストは、まとめて1回の encode で埋め込みます。
+# 同時に計算する要求は max_concurrency 件まで、受け付け中の要求が max_pending 件を超えると 503 を返します。
+
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from file_io import collect_uml, format_class, format_relation, iter_uml_lines
+from main import find_best_matches, merge_uml_data
+from multi_merge import diagram_texts
+from precision import PRECISIONS
+from scoring import DEFAULT_WEIGHTS
+from similarity_calculator import SimilarityCalculator
+
+MAX_BODY_SIZE = 64 << 20
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+                500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class RequestError(Exception):
+    """要求の内容が正しくないときのエラー。status は返す HTTP ステータスです。"""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_uml_text(text):
+    """クラス図ファイルと同じ形式の文字列を parse_uml_file と同じ形式の辞書にします。"""
+    return collect_uml(iter_uml_lines(text.splitlines()))
+
+
+def format_uml_text(uml_data):
+    """write_uml_file が書き出すのと同じ内容の文字列を返します。"""
+    return "".join(map(format_class, uml_data["classes"])) + "".join(map(format_relation, uml_data["relations"]))
+
+
+class MergeService:
+    """
+    サーバーの処理本体。HTTP とは切り離してあり、handle(path, payload) を直接 await して使うこともできます。
+    - 埋め込み: embed() に渡されたテキストを batch_window 秒だけ溜め、calculator.preload でまとめてエンコードする
+    - 計算: find_best_matches / merge_uml_data はスレッドプールで実行し、同時実行数を max_concurrency に抑える
+    - 背圧: 受け付け中の要求が max_pending 件に達していたら、新しい要求は 503 で断る
+    """
+    def __init__(self, calculator, batch_window=0.005, max_concurrency=4, max_pending=64):
+        self.calculator = calculator
+        self.batch_window = batch_window
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        # エンコードは1本のスレッドで順に行う（バッチ同士でモデルを取り合わないように）
+        self._encode_executor = ThreadPoolExecutor(max_workers=1)
+        self._semaphore = None
+        self._batch_texts = []
+        self._batch_waiters = []
+        self._batch_timer = None
+        self.in_flight = 0
+        self.stats = {"requests": 0, "rejected": 0, "errors": 0, "encode_batches": 0, "texts_encoded": 0}
+
+    async def embed(self, texts):
+        """texts の埋め込みを calculator に用意します。近い時刻の要求のテキストと一緒にエンコードします。"""
+        if not texts:
+            return
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._batch_texts.extend(texts)
+        self._batch_waiters.append(waiter)
+        if self._batch_timer is None:
+            self._batch_timer = loop.call_later(self.batch_window, self._flush_batch)
+        await waiter
+
+    def _flush_batch(self):
+        texts, waiters = list(dict.fromkeys(self._batch_texts)), self._batch_waiters
+        self._batch_texts, self._batch_waiters, self._batch_timer = [], [], None
+        self.stats["encode_batches"] += 1
+        self.stats["texts_encoded"] += len(texts)
+        loop = asyncio.get_running_loop()
+        task = loop.run_in_executor(self._encode_executor, self.calculator.preload, texts)
+
+        def notify(done):
+            error = done.exception()
+            for waiter in waiters:
+                if waiter.done():
+                    continue
+                if error is None:
+                    waiter.set_result(None)
+                else:
+                    waiter.set_exception(error)
+        task.add_done_callback(notify)
+
+    async def _compute(self, func, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def handle(self, path, payload):
+        """1件の要求を処理し、(HTTP ステータス, 応答の辞書) を返します。"""
+        routes = {"/merge": self._merge, "/match": self._match, "/similarity": self._similarity}
+        if path == "/stats":
+            return 200, dict(self.stats, in_flight=self.in_flight)
+        if path not in routes:
+            return 404, {"error": f"不明なパスです: {path}"}
+        if self.in_flight >= self.max_pending:
+            self.stats["rejected"] += 1
+            return 503, {"error": "処理中の要求が多すぎます。しばらくしてから再送してください。"}
+
+        self.in_flight += 1
+        self.stats["requests"] += 1
+        try:
+            return 200, await routes[path](payload)
+        except RequestError as e:
+            self.stats["errors"] += 1
+            return e.status, {"error": str(e)}
+        except (KeyError, TypeError, ValueError) as e:
+            self.stats["errors"] += 1
+            return 400, {"error": f"{type(e).__name__}: {e}"}
+        except Exception as e:
+            # モデルや計算の失敗でも接続を切らず、必ず応答を返す
+            self.stats["errors"] += 1
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            self.in_flight -= 1
+
+    async def _prepare(self, payload):
+        if not isinstance(payload, dict) or "a" not in payload or "b" not in payload:
+            raise RequestError("'a' と 'b' に図の内容を指定してください。")
+        if not (isinstance(payload["a"], str) and isinstance(payload["b"], str)):
+            raise RequestError("'a' と 'b' には図の内容を文字列で指定してください。")
+        data_a, data_b = parse_uml_text(payload["a"]), parse_uml_text(payload["b"])
+        await self.embed(diagram_texts(data_a) + diagram_texts(data_b))
+        options = {"threshold": float(payload.get("threshold", 0.6)),
+                   "weights": dict(DEFAULT_WEIGHTS, **payload.get("weights", {})),
+                   "strategy": payload.get("strategy", "greedy")}
+        return data_a, data_b, options
+
+    def _find_matches(self, data_a, data_b, options):
+        return find_best_matches(data_a, data_b, self.calculator, options["threshold"], options["weights"],
+                                 options["strategy"], collect_all_scores=False)
+
+    async def _match(self, payload):
+        data_a, data_b, options = await self._prepare(payload)
+        matches, unmatched_a, unmatched_b, _ = await self._compute(self._find_matches, data_a, data_b, options)
+        return {"matches": [{"a": cls_a.id, "b": cls_b.id, "score": score, "semantic": sem,
+                             "structural": stru, "spatial": spa}
+                            for score, sem, _, stru, spa, cls_a, cls_b in matches],
+                "unmatched_a": [cls.id for cls in unmatched_a],
+                "unmatched_b": [cls.id for cls in unmatched_b]}
+
+    async def _merge(self, payload):
+        data_a, data_b, options = await self._prepare(payload)
+        layout = payload.get("layout", "legacy")
+
+        def run():
+            matches, unmatched_a, unmatched_b, _ = self._find_matches(data_a, data_b, options)
+            merged = merge_uml_data(matches, unmatched_a, unmatched_b, data_a, data_b, self.calculator,
+                                    layout=layout)
+            return merged, len(matches), len(unmatched_a), len(unmatched_b)
+
+        merged, n_matches, n_unmatched_a, n_unmatched_b = await self._compute(run)
+        return {"merged": format_uml_text(merged), "matches": n_matches,
+                "unmatched_a": n_unmatched_a, "unmatched_b": n_unmatched_b,
+                "classes": len(merged["classes"]), "relations": len(merged["relations"])}
+
+    async def _similarity(self, payload):
+        texts_a, texts_b = list(payload["texts_a"]), list(payload["texts_b"])
+        await self.embed(texts_a + texts_b)
+        matrix = await self._compute(self.calculator.get_similarity_matrix, texts_a, texts_b)
+        return {"matrix": matrix.tolist()}
+
+    def close(self):
+        self._executor.shutdown()
+        self._encode_executor.shutdown()
+
+
+async def _read_request(reader):
+    """HTTP/1.1 の要求を1件読み、(メソッド, パス, ヘッダー, 本文) を返します。接続が閉じられたら None を返します。"""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, path, _ = request_line.decode('latin-1').split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_SIZE:
+        raise RequestError("要求の本文が大きすぎます。", status=413)
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def _write_response(writer, status, body, keep_alive):
+    data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + data)
+
+
+async def serve_connection(service, reader, writer):
+    """1つの接続で届く要求を順に処理します (keep-alive に対応)。"""
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+            except RequestError as e:
+                _write_response(writer, e.status, {"error": str(e)}, keep_alive=False)
+                break
+            except (ValueError, asyncio.IncompleteReadError):
+                _write_response(writer, 400, {"error": "HTTP の要求として読めません。"}, keep_alive=False)
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            keep_alive = headers.get("connection", "").lower() != "close"
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                status, response = 400, {"error": "本文が JSON ではありません。"}
+            else:
+                status, response = await service.handle(path.split("?", 1)[0], payload)
+            _write_response(writer, status, response, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(service, host="127.0.0.1", port=8765, unix_path=None):
+    """サーバーを起動して asyncio の Server を返します。unix_path を指定すると Unix ソケットで待ち受けます。"""
+    def client_connected(reader, writer):
+        return serve_connection(service, reader, writer)
+    if unix_path:
+        return await asyncio.start_unix_server(client_connected, path=unix_path)
+    return await asyncio.start_server(client_connected, host, port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モデルを読み込んだまま常駐するマージサーバーを起動します。")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="TCP の代わりに待ち受ける Unix ソケットのパス")
+    parser.add_argument("--cache-dir", default=".embedding_cache")
+    parser.add_argument("--batch-window", type=float, default=0.005, help="要求をまとめてエンコードする待ち時間 (秒)")
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--preload-limit", type=int, default=100000, help="メモリに保持する埋め込みの最大件数")
+    parser.add_argument("--offline", action="store_true", help="モデルを読み込まず、キャッシュ済みの埋め込みだけを使う")
+    parser.add_argument("--truncate-dim", type=int, default=None, help="埋め込みを切り詰める次元 (512 / 256 / 128)")
+    parser.add_argument("--precision", choices=PRECISIONS, default="float32", help="メモリに保持する埋め込みの型")
+    args = parser.parse_args()
+
+    calculator = SimilarityCalculator(cache_dir=args.cache_dir, preload_limit=args.preload_limit,
+                                      offline=args.offline, truncate_dim=args.truncate_dim,
+                                      precision=args.precision)
+    # 常駐サーバーなので、最初の要求を待たずにモデルを読み込んでおく
+    if not args.offline and not calculator.model: return
+    service = MergeService(calculator, args.batch_window, args.max_concurrency, args.max_pending)
+
+    async def run():
+        server = await start_server(service, args.host, args.port, args.unix)
+        print(f"マージサーバーを起動しました: {args.unix or f'http://{args.host}:{args.port}'}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        calculator.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# multi_merge.py (多数のクラス図を二分木の形で順にマージする)
+#
+# 使い方: python multi_merge.py 出力ファイル 図1.txt 図2.txt 図3.txt ... [--workers 4]
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from file_io import parse_uml_file, write_uml_file
+from main import find_best_matches, merge_uml_data
+from scoring import DEFAULT_WEIGHTS, class_text
+from similarity_calculator import SimilarityCalculator
+
+_worker_calculator = None
+
+
+class StoreOnlyEncoder:
+    """
+    ワーカープロセス用のエンコーダー。埋め込みはすべて親プロセスが共有ストアに書き込んでおくため、
+    モデルは読み込まず、ストアにないテキストを求められた場合はエラーにします。
+    """
+    def __init__(self, dim):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        raise RuntimeError(f"共有埋め込みストアにないテキストがあります: {texts[:3]}")
+
+
+def diagram_texts(diagram):
+    """マージで埋め込みが必要になるテキスト（クラスのテキストと属性）を列挙します。"""
+    texts = [class_text(cls) for cls in diagram["classes"]]
+    texts.extend(attr for cls in diagram["classes"] for attr in cls.attributes)
+    return texts
+
+
+def merge_pair(data_a, data_b, calculator, threshold=0.6, weights=None, strategy="greedy", layout="auto"):
+    """2つの図をマッチングしてマージした図を返します。"""
+    matches, unmatched_a, unmatched_b, _ = find_best_matches(
+        data_a, data_b, calculator, threshold, weights, strategy, collect_all_scores=False)
+    return merge_uml_data(matches, unmatched_a, unmatched_b, data_a, data_b, calculator, layout=layout)
+
+
+def _init_worker(model_name, cache_dir, dim, truncate_dim, precision):
+    global _worker_calculator
+    # 親と同じ切り詰め・量子化でスコアを計算する（workers の数で結果が変わらないように）
+    _worker_calculator = SimilarityCalculator(model_name, encoder=StoreOnlyEncoder(dim),
+                                              cache_dir=cache_dir, cache_read_only=True,
+                                              truncate_dim=truncate_dim, precision=precision)
+
+
+def _merge_in_worker(args):
+    data_a, data_b, options = args
+    return merge_pair(data_a, data_b, _worker_calculator, **options)
+
+
+def merge_many(diagrams, calculator, threshold=0.6, weights=None, strategy="greedy", layout="auto",
+               workers=None, verbose=True):
+    """
+    複数の図を二分木の形でマージします。各段では (0, 1), (2, 3), ... の組を独立にマージし、
+    奇数個のときは最後の図をそのまま次の段に送ります。組の並びは入力の順で固定なので結果は決定的です。
+
+    各段の前に、その段の全テキストを親プロセスの calculator でまとめてエンコードして共有ストアに保存し、
+    ワーカープロセスはストアを読み取り専用で開きます（モデルの読み込みも再エンコードもしません）。
+    モデルを読み込めなかった・offline でキャッシュにないなど、埋め込みを得られないテキストがあった段は
+    （ストアにないためワーカーでは扱えないので）親プロセスでマージし、workers=1 のときと同じ結果にします。
+    戻り値は (マージ結果, 段ごとの所要時間のリスト) です。
+    """
+    if not diagrams:
+        raise ValueError("マージする図がありません。")
+    weights = weights or DEFAULT_WEIGHTS
+    options = {"threshold": threshold, "weights": weights, "strategy": strategy, "layout": layout}
+    workers = workers or os.cpu_count() or 1
+
+    temp_dir = None
+    if workers > 1 and not calculator.cache_dir:
+        temp_dir = tempfile.TemporaryDirectory()
+        calculator.set_cache_dir(temp_dir.name)
+
+    timings = []
+    level = 0
+    current = list(diagrams)
+    pool = None
+    try:
+        # ワーカーは共有ストアを読むだけなので、ストアの次元（キャッシュ済みならモデルを読み込まずに分かる）を渡す。
+        # 次元が分からない（モデルを読み込めず、キャッシュもない）ときはワーカーを使わない
+        cache = calculator.cache if workers > 1 else None
+        if cache is not None:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(calculator.model_name, calculator.cache_dir, cache.dim,
+                                                 calculator.precision.truncate_dim, calculator.precision.precision))
+        while len(current) > 1:
+            level += 1
+            start = time.perf_counter()
+            unembedded = calculator.unembedded
+            if calculator.cache_dir:
+                calculator.encode([text for diagram in current for text in diagram_texts(diagram)])
+            embed_seconds = time.perf_counter() - start
+            # 埋め込みを得られなかったテキストはストアにないので、この段は親プロセスでマージする
+            use_pool = pool is not None and calculator.unembedded == unembedded
+
+            pairs = [(current[i], current[i + 1], options) for i in range(0, len(current) - 1, 2)]
+            if use_pool:
+                merged = list(pool.map(_merge_in_worker, pairs))
+            else:
+                merged = [merge_pair(a, b, calculator, **opts) for a, b, opts in pairs]
+            if len(current) % 2:
+                merged.append(current[-1])
+
+            timing = {"level": level, "merges": len(pairs), "diagrams_out": len(merged), "in_workers": use_pool,
+                      "embed_seconds": embed_seconds, "seconds": time.perf_counter() - start}
+            timings.append(timing)
+            if verbose:
+                print(f"段 {level}: {len(pairs)} 組をマージ -> {len(merged)} 図 "
+                      f"({timing['seconds']:.2f} 秒, うち埋め込み {embed_seconds:.2f} 秒)")
+            current = merged
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if temp_dir is not None:
+            calculator.set_cache_dir(None)
+            temp_dir.cleanup()
+    return current[0], timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数のクラス図を1つにマージします。")
+    parser.add_argument("output", help="マージ結果の出力ファイル")
+    parser.add_argument("inputs", nargs="+", help="マージするクラス図ファイル")
+    parser.add_argument("--workers", type=int, default=None, help="並列に動かすプロセス数")
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--strategy", choices=["greedy", "optimal"], default="greedy")
+    parser.add_argument("--cache-dir", default=".embedding_cache")
+    args = parser.parse_args()
+
+    diagrams = [parse_uml_file(path) for path in args.inputs]
+    if not all(diagrams): return
+    calculator = SimilarityCalculator(cache_dir=args.cache_dir)
+    merged, _ = merge_many(diagrams, calculator, args.threshold, strategy=args.strategy, workers=args.workers)
+    if calculator.load_failed: return
+    write_uml_file(args.output, merged)
+    calculator.close()
+    print(f"{len(args.inputs)} 個の図をマージし、'{args.output}' に結果を保存しました。")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,39 @@
+# offline_encoder.py (モデルを使わない決定的なエンコーダー)
+
+import hashlib
+
+import numpy as np
+
+class HashingEncoder:
+    """
+    文字n-gramをハッシュして固定長ベクトルにする、決定的なスタンドインのエンコーダー。
+    SentenceTransformer と同じ encode(texts, batch_size=...) の形で呼び出せるため、
+    ネットワークやモデルなしで SimilarityCalculator(encoder=HashingEncoder()) として使えます。
+    """
+    def __init__(self, dim=256, ngram_range=(1, 2)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.encode_calls = 0
+        self.texts_encoded = 0
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        padded = f"^{text}$"
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(padded) - n + 1):
+                digest = hashlib.blake2b(padded[i:i + n].encode('utf-8'), digest_size=8).digest()
+                h = int.from_bytes(digest, 'little')
+                vector[h % self.dim] += 1.0 if (h >> 63) else -1.0
+        return vector
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        """テキストのリストを (len(texts), dim) の float32 行列に変換します。"""
+        self.encode_calls += 1
+        self.texts_encoded += len(texts)
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self._embed(text) for text in texts])
\ No newline at end of file
@@ -0,0 +1,93 @@
+# precision.py (埋め込みの次元の切り詰めと量子化)
+
+import numpy as np
+
+PRECISIONS = ("float32", "float16", "int8")
+# EmbeddingGemma は Matryoshka 表現学習で訓練されているため、先頭の次元だけを使っても意味を保ちやすい
+MATRYOSHKA_DIMS = (768, 512, 256, 128)
+
+
+class EmbeddingPrecision:
+    """
+    埋め込みの精度の設定。
+    - truncate_dim: 先頭の truncate_dim 次元だけを残して正規化し直す（None なら全次元）
+    - precision: メモリに保持するときの型。"float16" は半精度、"int8" はベクトルごとのスケールを持つ8ビット整数
+    類似度の計算は保持した値を float32 に戻してから行います（numpy には float16 / int8 の高速な行列積がないため）。
+    """
+    def __init__(self, truncate_dim=None, precision="float32"):
+        if precision not in PRECISIONS:
+            raise ValueError(f"未知の精度です: {precision} (選択肢: {', '.join(PRECISIONS)})")
+        if truncate_dim is not None and int(truncate_dim) <= 0:
+            raise ValueError(f"truncate_dim は正の整数で指定してください: {truncate_dim}")
+        self.truncate_dim = int(truncate_dim) if truncate_dim is not None else None
+        self.precision = precision
+
+    @property
+    def is_full(self):
+        """モデルの出力をそのまま使う設定か"""
+        return self.truncate_dim is None and self.precision == "float32"
+
+    def __repr__(self):
+        return f"EmbeddingPrecision(truncate_dim={self.truncate_dim}, precision='{self.precision}')"
+
+    def output_dim(self, dim):
+        """モデルの次元が dim のときに、この設定で使う次元"""
+        if dim is None or self.truncate_dim is None:
+            return dim
+        return min(dim, self.truncate_dim)
+
+    def bytes_per_vector(self, dim):
+        """1ベクトルを保持するのに必要なバイト数（int8 はスケールの4バイトを含む）"""
+        dim = self.output_dim(dim)
+        return {"float32": 4 * dim, "float16": 2 * dim, "int8": dim + 4}[self.precision]
+
+    def truncate(self, embeddings):
+        """先頭の truncate_dim 次元に切り詰めて正規化し直します。"""
+        if self.truncate_dim is None or embeddings.shape[1] <= self.truncate_dim:
+            return embeddings
+        embeddings = embeddings[:, :self.truncate_dim]
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return (embeddings / np.where(norms == 0, 1.0, norms)).astype(np.float32)
+
+    def pack(self, embeddings):
+        """
+        (n, dim) の float32 の行列を保持用の形にします。
+        float32 / float16 はその型の行列、int8 は (int8 の行列, float32 のスケール) の組を返します。
+        """
+        embeddings = self.truncate(np.asarray(embeddings, dtype=np.float32))
+        if self.precision == "float16":
+            return embeddings.astype(np.float16)
+        if self.precision == "int8":
+            scale = np.abs(embeddings).max(axis=1) / 127 if embeddings.size else np.zeros(len(embeddings))
+            safe = np.where(scale == 0, 1.0, scale)
+            quantized = np.clip(np.rint(embeddings / safe[:, None]), -127, 127).astype(np.int8)
+            return quantized, scale.astype(np.float32)
+        return embeddings
+
+    def unpack(self, packed):
+        """pack した値を float32 の行列に戻します。"""
+        if self.precision == "int8":
+            quantized, scale = packed
+            return quantized.astype(np.float32) * scale[:, None]
+        return np.asarray(packed, dtype=np.float32)
+
+    def apply(self, embeddings):
+        """切り詰めと量子化の誤差を含めた float32 の行列を返します（完全精度の設定ならそのまま返します）。"""
+        if self.is_full:
+            return embeddings
+        return self.unpack(self.pack(embeddings))
+
+    def pack_rows(self, embeddings):
+        """pack した結果を1行ずつに分けて返します（preload でテキストごとに保持するため）。"""
+        packed = self.pack(embeddings)
+        if self.precision == "int8":
+            quantized, scale = packed
+            return [(row, scale[i:i + 1]) for i, row in enumerate(quantized)]
+        return list(packed)
+
+    def unpack_row(self, row):
+        """pack_rows の1行を float32 のベクトルに戻します。"""
+        if self.precision == "int8":
+            quantized, scale = row
+            return quantized.astype(np.float32) * scale[0]
+        return np.asarray(row, dtype=np.float32)
@@ -0,0 +1,121 @@
+# precision_check.py (埋め込みの精度の設定ごとに、マッチ結果が完全精度と同じかを調べる)
+#
+# 使い方: python precision_check.py 図A1.txt 図B1.txt [図A2.txt 図B2.txt ...]
+#             [--dims 512 256 128] [--precisions float32 float16 int8] [--json precision_report.json]
+#
+# 入力は図Aと図Bのファイルを交互に並べたペアのリストです。各ペアを完全精度 (768次元・float32) と
+# 各設定でマッチングし、採用されたクラスペアが変わらない設定のうち最も小さいものを表示します。
+# 埋め込みはキャッシュ (--cache-dir) を通して1回だけエンコードし、設定ごとに切り詰め・量子化だけをやり直します。
+
+import argparse
+import json
+import tempfile
+
+from file_io import parse_uml_file
+from main import find_best_matches
+from multi_merge import diagram_texts
+from offline_encoder import HashingEncoder
+from precision import MATRYOSHKA_DIMS, PRECISIONS
+from scoring import DEFAULT_WEIGHTS
+from similarity_calculator import SimilarityCalculator
+
+
+def _matches(data_a, data_b, calculator, threshold, weights, strategy):
+    matches = find_best_matches(data_a, data_b, calculator, threshold, weights, strategy,
+                                collect_all_scores=False)[0]
+    return {(cls_a.id, cls_b.id): score for score, _, _, _, _, cls_a, cls_b in matches}
+
+
+def check_precisions(pairs, calculator, settings, threshold=0.6, weights=None, strategy="greedy"):
+    """
+    pairs ([(data_a, data_b), ...]) を、calculator（完全精度）と settings の各 (truncate_dim, precision) で
+    マッチングし、設定ごとの比較結果の辞書のリストを返します。
+    - changed_pairs: マッチ結果が完全精度と異なった図のペアの数
+    - missing / extra: 完全精度にはあるのに失われた / 完全精度にはないのに加わったクラスペアの数
+    - max_score_diff: 両方で採用されたクラスペアの合計スコアの差の最大値
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    # すべてのテキストを先にまとめてエンコードし、キャッシュに載せておく
+    calculator.encode([text for data_a, data_b in pairs for diagram in (data_a, data_b)
+                       for text in diagram_texts(diagram)])
+    reference = [_matches(a, b, calculator, threshold, weights, strategy) for a, b in pairs]
+    base_dim = calculator.embedding_dimension
+
+    results = []
+    for truncate_dim, precision in settings:
+        reduced = SimilarityCalculator(calculator.model_name,
+                                       encoder=calculator.model if calculator.model_loaded else None,
+                                       cache_dir=calculator.cache_dir, offline=calculator.offline,
+                                       truncate_dim=truncate_dim, precision=precision)
+        result = {"truncate_dim": reduced.precision.output_dim(base_dim), "precision": precision,
+                  "bytes_per_vector": reduced.precision.bytes_per_vector(base_dim),
+                  "changed_pairs": 0, "missing": 0, "extra": 0, "max_score_diff": 0.0}
+        for (data_a, data_b), expected in zip(pairs, reference):
+            actual = _matches(data_a, data_b, reduced, threshold, weights, strategy)
+            missing, extra = expected.keys() - actual.keys(), actual.keys() - expected.keys()
+            result["changed_pairs"] += bool(missing or extra)
+            result["missing"] += len(missing)
+            result["extra"] += len(extra)
+            for key in expected.keys() & actual.keys():
+                result["max_score_diff"] = max(result["max_score_diff"], abs(expected[key] - actual[key]))
+        results.append(result)
+    return results
+
+
+def cheapest_unchanged(results):
+    """マッチ結果が完全精度と同じ設定のうち、1ベクトルあたりのバイト数が最も小さいものを返します。"""
+    unchanged = [r for r in results if r["changed_pairs"] == 0]
+    return min(unchanged, key=lambda r: r["bytes_per_vector"]) if unchanged else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="埋め込みの精度の設定ごとに、マッチ結果が完全精度と同じかを調べます。")
+    parser.add_argument("files", nargs="+", help="図Aと図Bのファイルを交互に並べたもの")
+    parser.add_argument("--dims", type=int, nargs="+", default=list(MATRYOSHKA_DIMS))
+    parser.add_argument("--precisions", nargs="+", choices=PRECISIONS, default=list(PRECISIONS))
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--strategy", choices=["greedy", "optimal"], default="greedy")
+    parser.add_argument("--cache-dir", default=".embedding_cache")
+    parser.add_argument("--offline-encoder", action="store_true",
+                        help="モデルの代わりに HashingEncoder (768次元) を使う（動作確認用）")
+    parser.add_argument("--json", default=None, help="結果を書き出す JSON ファイル")
+    args = parser.parse_args()
+
+    if len(args.files) % 2:
+        parser.error("図Aと図Bのファイルをペアで指定してください。")
+    diagrams = [parse_uml_file(path) for path in args.files]
+    if not all(diagrams): return
+    pairs = list(zip(diagrams[0::2], diagrams[1::2]))
+
+    temp_dir = None
+    if args.offline_encoder:
+        # 本物のモデルのキャッシュと混ざらないように、一時ディレクトリを使う
+        temp_dir = tempfile.TemporaryDirectory()
+        calculator = SimilarityCalculator("offline-hashing", encoder=HashingEncoder(dim=768), cache_dir=temp_dir.name)
+    else:
+        calculator = SimilarityCalculator(cache_dir=args.cache_dir)
+    settings = [(dim, precision) for dim in args.dims for precision in args.precisions]
+    results = check_precisions(pairs, calculator, settings, args.threshold, strategy=args.strategy)
+    calculator.close()
+    if calculator.load_failed: return
+
+    print(f"{'Dim':<6}{'Precision':<11}{'Bytes':<8}{'Changed':<9}{'Missing':<9}{'Extra':<7}{'MaxScoreDiff':<12}")
+    print("-" * 62)
+    for r in results:
+        print(f"{r['truncate_dim']:<6}{r['precision']:<11}{r['bytes_per_vector']:<8}{r['changed_pairs']:<9}"
+              f"{r['missing']:<9}{r['extra']:<7}{r['max_score_diff']:<12.6f}")
+    best = cheapest_unchanged(results)
+    if best:
+        print(f"\nマッチ結果が変わらない最小の設定: truncate_dim={best['truncate_dim']}, precision={best['precision']} "
+              f"({best['bytes_per_vector']} バイト/ベクトル, {len(pairs)} ペア)")
+    else:
+        print("\nマッチ結果が完全精度と同じになる設定はありませんでした。")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"pairs": len(pairs), "results": results, "cheapest_unchanged": best}, f,
+                      ensure_ascii=False, indent=2)
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+if __name__ == "__main__":
+    main()
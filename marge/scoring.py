@@ -0,0 +1,146 @@
+# scoring.py (クラスペアのスコアを行列でまとめて計算するエンジン)
+
+import math
+
+import numpy as np
+
+from diagram_model import ColumnarDiagram
+from spatial import compare_signature_arrays, spatial_similarity_matrix
+
+DEFAULT_WEIGHTS = {"semantic": 0.7, "relational": 0.0, "structural": 0.15, "spatial": 0.15}
+
+
+def class_text(cls):
+    """意味的類似度の計算に使うクラスのテキスト（クラス名 + 属性）"""
+    return f"{cls.name} {' '.join(cls.attributes)}"
+
+
+def compare_signatures(sig_a, sig_b):
+    if not sig_a and not sig_b: return 1.0
+    if not sig_a or not sig_b: return 0.0
+    def vector_distance(v1, v2):
+        return math.sqrt((v1[0] - v2[0])**2 + (v1[1] - v2[1])**2)
+    total_distance = 0
+    matched_b_indices = set()
+    for vec_a in sig_a:
+        min_dist = float('inf')
+        best_match_idx = -1
+        for i, vec_b in enumerate(sig_b):
+            if i in matched_b_indices: continue
+            dist = vector_distance(vec_a, vec_b)
+            if dist < min_dist:
+                min_dist = dist
+                best_match_idx = i
+        if best_match_idx != -1:
+            total_distance += min_dist
+            matched_b_indices.add(best_match_idx)
+    avg_distance = total_distance / len(sig_a) if sig_a else 0
+    similarity = 1 / (1 + avg_distance / 100)
+    len_diff_penalty = 1.0 - (abs(len(sig_a) - len(sig_b)) / max(len(sig_a), len(sig_b)))
+    return similarity * len_diff_penalty
+
+
+class DiagramFeatures:
+    """
+    1つのクラス図について、スコア計算に必要な特徴量を一度だけ計算して保持するクラス。
+    - out_degree / in_degree: 各クラスが関連の source / target になっている数
+    - signatures: 各クラスから見た隣接クラスへの相対ベクトル（get_spatial_signature と同じ内容の (k, 2) 配列）
+    """
+    def __init__(self, diagram_data):
+        self.classes = list(diagram_data["classes"])
+        # 次数と隣接クラスは列指向の表現 (CSR) から配列演算で求める
+        diagram = ColumnarDiagram.from_dict(diagram_data)
+        self.out_degree = diagram.out_degree.astype(np.float64)
+        self.in_degree = diagram.in_degree.astype(np.float64)
+        self.texts = [class_text(cls) for cls in self.classes]
+
+        ptr, offsets = diagram.relative_offsets()
+        offsets = offsets.astype(np.float64)
+        self.signatures = [offsets[ptr[i]:ptr[i + 1]] for i in range(len(self.classes))]
+
+    def __len__(self):
+        return len(self.classes)
+
+
+class ScoreMatrices:
+    """全クラスペアのスコア行列 (行: 図Aのクラス, 列: 図Bのクラス)"""
+    def __init__(self, classes_a, classes_b, semantic, structural, spatial, total):
+        self.classes_a = classes_a
+        self.classes_b = classes_b
+        self.semantic = semantic
+        self.structural = structural
+        self.spatial = spatial
+        self.total = total
+
+    def rows(self):
+        """find_best_matches の all_scores と同じ形式のタプルを、A の順 × B の順で返します。"""
+        n_b = len(self.classes_b)
+        totals = self.total.ravel().tolist()
+        semantics = self.semantic.ravel().tolist()
+        structurals = self.structural.ravel().tolist()
+        spatials = self.spatial.ravel().tolist()
+        return [(totals[k], semantics[k], 0.0, structurals[k], spatials[k],
+                 self.classes_a[k // n_b], self.classes_b[k % n_b])
+                for k in range(len(totals))]
+
+    def top_rows(self, limit):
+        """rows() を合計スコアの降順に安定ソートしたときの先頭 limit 件だけを作ります。"""
+        if limit <= 0:
+            return []
+        flat = self.total.ravel()
+        if limit >= flat.size:
+            positions = np.arange(flat.size)
+        else:
+            # limit 番目に大きい値より大きいものと、その値と同点のものを添字の小さい順に必要な数だけ残す
+            kth = np.partition(flat, flat.size - limit)[flat.size - limit]
+            above = np.flatnonzero(flat > kth)
+            ties = np.flatnonzero(flat == kth)[:limit - len(above)]
+            positions = np.sort(np.concatenate([above, ties]))
+        positions = positions[np.argsort(-flat[positions], kind='stable')]
+        n_b = len(self.classes_b)
+        return [(float(self.total.flat[k]), float(self.semantic.flat[k]), 0.0, float(self.structural.flat[k]),
+                 float(self.spatial.flat[k]), self.classes_a[k // n_b], self.classes_b[k % n_b])
+                for k in positions.tolist()]
+
+
+def _structural(out_a, out_b, in_a, in_b):
+    source_diff = np.abs(out_a - out_b) / np.maximum(1, out_a + out_b)
+    target_diff = np.abs(in_a - in_b) / np.maximum(1, in_a + in_b)
+    return 1.0 - (source_diff + target_diff) / 2
+
+
+def structural_matrix(features_a, features_b):
+    """calculate_structural_similarity を全ペアについて配列演算で計算します。"""
+    return _structural(features_a.out_degree[:, None], features_b.out_degree[None, :],
+                       features_a.in_degree[:, None], features_b.in_degree[None, :])
+
+
+def score_matrices(features_a, features_b, calculator, weights, spatial_mode="greedy", spatial=None):
+    """
+    意味・構造・空間のスコア行列を計算し、weights で重み付けした合計行列とまとめて返します。
+    spatial に計算済みの空間スコア行列を渡すと、空間シグネチャの比較を省略します。
+    """
+    semantic = np.asarray(calculator.get_similarity_matrix(features_a.texts, features_b.texts),
+                          dtype=np.float64).reshape(len(features_a), len(features_b))
+    structural = structural_matrix(features_a, features_b)
+    if spatial is None:
+        spatial = spatial_similarity_matrix(features_a.signatures, features_b.signatures, spatial_mode)
+    total = (semantic * weights["semantic"] +
+             structural * weights["structural"] +
+             spatial * weights["spatial"])
+    return ScoreMatrices(features_a.classes, features_b.classes, semantic, structural, spatial, total)
+
+
+def score_pairs(features_a, features_b, rows, cols, semantic, weights, spatial_mode="greedy"):
+    """
+    (rows[k], cols[k]) で指定したペアだけについて構造・空間スコアを計算し、
+    semantic と合わせて (structural, spatial, total) の配列を返します。
+    """
+    structural = _structural(features_a.out_degree[rows], features_b.out_degree[cols],
+                             features_a.in_degree[rows], features_b.in_degree[cols])
+    spatial = np.array([compare_signature_arrays(features_a.signatures[i], features_b.signatures[j], spatial_mode)
+                        for i, j in zip(rows.tolist(), cols.tolist())], dtype=np.float64)
+    total = (semantic * weights["semantic"] +
+             structural * weights["structural"] +
+             spatial * weights["spatial"])
+    return structural, spatial, total
\ No newline at end of file
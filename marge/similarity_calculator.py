@@ -1,33 +1,266 @@
 # similarity_calculator.py (300mモデル版)
 
-from sentence_transformers import SentenceTransformer, util
+import threading
+
+import numpy as np
+from embedding_cache import EmbeddingCache
+from instrumentation import count, phase, sample
+from precision import EmbeddingPrecision
+
+_NOT_LOADED = object()
+
+def cosine_matrix(texts_a, emb_a, texts_b, emb_b):
+    """
+    encode の結果から texts_a × texts_b のコサイン類似度行列 (float64) を作ります。
+    埋め込みを得られなかった（ゼロベクトルの）テキストは、同じテキスト同士に限って類似度 1 とします。
+    """
+    similarity = (emb_a @ emb_b.T).astype(np.float64)
+    blank_a = np.flatnonzero(~emb_a.any(axis=1))
+    if len(blank_a):
+        blank_b = {}
+        for j in np.flatnonzero(~emb_b.any(axis=1)):
+            blank_b.setdefault(texts_b[j], []).append(j)
+        for i in blank_a:
+            similarity[i, blank_b.get(texts_a[i], [])] = 1.0
+    return similarity
+
 
 class SimilarityCalculator:
     """SentenceTransformerを使ってテキストの類似度を計算するクラス"""
 
     # ここのモデル名を'google/embeddinggemma-300m'に変更します
-    def __init__(self, model_name='google/embeddinggemma-300m'):
+    def __init__(self, model_name='google/embeddinggemma-300m', encoder=None, batch_size=32,
+                 cache_dir=None, cache_max_entries=200000, cache_read_only=False, preload_limit=None,
+                 offline=False, truncate_dim=None, precision="float32"):
         """
-        コンストラクタ。指定されたモデルを読み込みます。
-        初回実行時はモデルのダウンロードに時間がかかる場合があります。
+        コンストラクタ。モデル (sentence_transformers) は、キャッシュにないテキストを
+        初めてエンコードするときに読み込みます。初回実行時はモデルのダウンロードに時間がかかる場合があります。
+        encoder に encode(texts, batch_size=...) を持つオブジェクトを渡した場合は
+        モデルを読み込まずにそれを使います（オフライン検証用のスタブなど）。
+        encoder が get_sentence_embedding_dimension() を持たない場合、次元は最初にエンコードした結果の幅で決めます。
+        cache_dir を指定すると、埋め込みをディスクに保存し、次回以降は未知のテキストだけをエンコードします。
+        preload_limit を指定すると、preload でメモリに保持する件数を古いものから削って制限します。
+        offline=True にするとモデルを一切読み込まず、preload 済み・キャッシュ済みの埋め込みだけを使います。
+        埋め込みのないテキストの類似度は（モデルがないときと同じく）0 とし、同じテキスト同士だけ 1 とします。
+        truncate_dim (512 / 256 / 128 など) と precision ("float32" / "float16" / "int8") で、
+        埋め込みの次元を切り詰めたり量子化したりできます（precision.EmbeddingPrecision）。
+        キャッシュにはモデルの出力をそのまま保存するので、設定を変えてもエンコードし直す必要はありません。
         """
-        print(f"'{model_name}' モデルを読み込んでいます...")
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_dir = cache_dir
+        self.cache_max_entries = cache_max_entries
+        self.cache_read_only = cache_read_only
+        self._cache = None
+        self._preloaded = {}
+        self._preload_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.preload_limit = preload_limit
+        self.offline = offline
+        self.unembedded = 0
+        self._encoded_dim = None
+        self.precision = EmbeddingPrecision(truncate_dim, precision)
+        self._model = encoder if encoder is not None else _NOT_LOADED
+
+    def _load_model(self):
+        print(f"'{self.model_name}' モデルを読み込んでいます...")
         try:
-            self.model = SentenceTransformer(model_name)
+            with phase("model_load"):
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(self.model_name)
             print("モデルの読み込みが完了しました。")
+            return model
         except Exception as e:
             print(f"モデル読み込み中にエラーが発生しました: {e}")
             print("Hugging Faceへのログインが完了しているか、モデルページで利用規約に同意しているか確認してください。")
-            self.model = None
+            return None
+
+    @property
+    def model(self):
+        """モデル（またはエンコーダー）。初めて参照されたときに読み込み、offline=True なら読み込まずに None を返します。"""
+        if self._model is _NOT_LOADED and not self.offline:
+            with self._load_lock:
+                if self._model is _NOT_LOADED:
+                    self._model = self._load_model()
+        return None if self._model is _NOT_LOADED else self._model
+
+    @property
+    def model_loaded(self):
+        """モデルの読み込みを試みたか（encoder を渡した場合は常に True）"""
+        return self._model is not _NOT_LOADED
+
+    @property
+    def load_failed(self):
+        """モデルの読み込みを試みて失敗したか"""
+        return self._model is None
+
+    def _model_dimension(self):
+        """読み込み済みのモデルの出力の次元。get_sentence_embedding_dimension がなければ、エンコードした結果の幅を返します。"""
+        if not self._model:
+            return None
+        get_dimension = getattr(self._model, "get_sentence_embedding_dimension", None)
+        return get_dimension() if get_dimension is not None else self._encoded_dim
+
+    @property
+    def embedding_dimension(self):
+        """encode が返す埋め込みの次元（truncate_dim を反映）。モデルを読み込まずに分からなければ None を返します。"""
+        if self.model_loaded:
+            dim = self._model_dimension()
+        elif self._cache is not None:
+            dim = self._cache.dim
+        else:
+            dims = EmbeddingCache.stored_dims(self.cache_dir, self.model_name) if self.cache_dir else []
+            dim = dims[0] if dims else None
+        if dim is None:
+            for vector in list(self._preloaded.values())[:1]:
+                return len(self.precision.unpack_row(vector))
+        return self.precision.output_dim(dim)
+
+    def encode(self, texts):
+        """
+        テキストのリストを正規化済みの埋め込み行列 (len(texts), dim) に変換します。
+        重複するテキストは1回だけエンコードし、batch_size 件ずつモデルに渡します。
+        truncate_dim / precision を指定した場合は、切り詰めと量子化を反映した float32 の行列を返します。
+        """
+        texts = list(texts)
+        count("encode_calls")
+        count("texts_requested", len(texts))
+        with phase("encode"):
+            return self._encode(texts)
+
+    def _encode(self, texts):
+        unique_texts = list(dict.fromkeys(texts))
+        if not unique_texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        found = {}
+        for text in unique_texts:
+            vector = self._preloaded.get(text)
+            if vector is not None:
+                found[text] = self.precision.unpack_row(vector)
+        count("preloaded_hits", len(found))
+        pending = [text for text in unique_texts if text not in found] if found else unique_texts
+        if pending:
+            # キャッシュとモデルはスレッドから同時に使わない
+            with self._encode_lock:
+                # キャッシュとモデルからはモデルの出力そのままの埋め込みが得られる
+                full = {}
+                cache = self.cache
+                if cache is not None:
+                    full.update(cache.get_many(pending))
+                    count("cache_hits", len(full))
+                    count("cache_misses", len(pending) - len(full))
+                missing = [text for text in pending if text not in full]
+                model = self.model if missing else None
+                if model:
+                    count("texts_embedded", len(missing))
+                    for start in range(0, len(missing), self.batch_size):
+                        sample("batch_size", min(self.batch_size, len(missing) - start))
+                    with phase("model_encode"):
+                        embeddings = np.asarray(
+                            model.encode(missing, batch_size=self.batch_size), dtype=np.float32)
+                    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+                    embeddings = embeddings / np.where(norms == 0, 1.0, norms)
+                    full.update(zip(missing, embeddings))
+                    self._encoded_dim = embeddings.shape[1]
+                    if cache is None:
+                        # 次元が分からずに開けなかったキャッシュは、エンコードした結果の幅で開く
+                        cache = self.cache
+                    if cache is not None:
+                        cache.put_many(missing, embeddings)
+                elif missing:
+                    self.unembedded += len(missing)
+                    count("texts_unembedded", len(missing))
+            if full and self.precision.is_full:
+                found.update(full)
+            elif full:
+                full_texts = list(full)
+                found.update(zip(full_texts, self.precision.apply(np.stack([full[text] for text in full_texts]))))
+
+        if len(found) < len(unique_texts):
+            # 埋め込みを得られなかったテキストはゼロベクトルにする（どのテキストとの類似度も 0）
+            dim = len(next(iter(found.values()))) if found else (self.embedding_dimension or 1)
+            zero = np.zeros(dim, dtype=np.float32)
+            return np.stack([found.get(text, zero) for text in texts])
+        return np.stack([found[text] for text in texts])
+
+    def preload(self, texts):
+        """
+        texts をまとめてエンコードしてメモリに保持します。
+        以降の encode では、保持しているテキストはキャッシュもモデルも使わずに返します。
+        複数の処理のテキストを1回のバッチにまとめたいときに使います。
+        precision を指定した場合は、その型 (float16 / int8) で保持します。
+        """
+        texts = list(dict.fromkeys(texts))
+        embeddings = self.precision.pack_rows(self.encode(texts)) if texts else []
+        with self._preload_lock:
+            for text, vector in zip(texts, embeddings):
+                # 既にあるテキストも入れ直して、削られる順番を後ろにする
+                self._preloaded.pop(text, None)
+                self._preloaded[text] = vector
+            if self.preload_limit is not None:
+                while len(self._preloaded) > self.preload_limit:
+                    self._preloaded.pop(next(iter(self._preloaded)))
+
+    @property
+    def cache(self):
+        """
+        cache_dir が指定されていれば EmbeddingCache を返します。
+        次元は読み込み済みのモデルか、保存済みのキャッシュから取得し、どちらもなければモデルを読み込みます。
+        """
+        if self._cache is None and self.cache_dir:
+            if self.model_loaded:
+                dim = self._model_dimension()
+                if dim is None and self._model:
+                    # 次元を返さないエンコーダーで、まだ何もエンコードしていない
+                    dims = EmbeddingCache.stored_dims(self.cache_dir, self.model_name)
+                    dim = dims[0] if dims else None
+            else:
+                dims = EmbeddingCache.stored_dims(self.cache_dir, self.model_name)
+                dim = dims[0] if dims else None
+                if dim is None and self.model:
+                    dim = self._model_dimension()
+            if dim is not None:
+                self._cache = EmbeddingCache(self.cache_dir, self.model_name, dim,
+                                             max_entries=self.cache_max_entries,
+                                             read_only=self.cache_read_only)
+        return self._cache
+
+    def set_cache_dir(self, cache_dir):
+        """埋め込みキャッシュの保存先を切り替えます（None で無効化）。"""
+        self.close()
+        self.cache_dir = cache_dir
+        self._cache = None
+
+    @property
+    def cache_hits(self):
+        return self._cache.hits if self._cache is not None else 0
+
+    @property
+    def cache_misses(self):
+        return self._cache.misses if self._cache is not None else 0
+
+    def close(self):
+        """キャッシュのLRU情報をディスクに書き出します。"""
+        if self._cache is not None:
+            self._cache.flush()
+
+    def get_similarity_matrix(self, texts_a, texts_b):
+        """
+        texts_a と texts_b の全組み合わせのコサイン類似度行列 (len(texts_a), len(texts_b)) を返します。
+        両リストに現れるテキストはまとめて1回だけエンコードします。
+        """
+        texts_a, texts_b = list(texts_a), list(texts_b)
+        if not texts_a or not texts_b:
+            return np.zeros((len(texts_a), len(texts_b)))
+
+        embeddings = self.encode(texts_a + texts_b)
+        emb_a, emb_b = embeddings[:len(texts_a)], embeddings[len(texts_a):]
+        return cosine_matrix(texts_a, emb_a, texts_b, emb_b)
 
     def get_similarity(self, text1, text2):
         """
         2つのテキストのコサイン類似度を計算します。
         """
-        if not self.model:
-            return 0.0
-
-        embeddings = self.model.encode([text1, text2])
-        score = util.cos_sim(embeddings[0], embeddings[1])[0][0]
-        
-        return score.item()
\ No newline at end of file
+        return float(self.get_similarity_matrix([text1], [text2])[0, 0])
\ No newline at end of file
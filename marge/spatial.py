@@ -0,0 +1,140 @@
+# spatial.py (空間シグネチャの高速な比較)
+
+import numpy as np
+
+# 図Bのシグネチャのベクトル数がこれを超えたら、距離行列の代わりに KD-tree で最近傍を探す
+KDTREE_MIN_SIZE = 256
+
+SPATIAL_MATCHING_MODES = ("greedy", "optimal")
+
+
+def signature_array(signature):
+    """(dx, dy) のリストを、辞書順にソートした (k, 2) の float64 配列にします。"""
+    array = np.asarray(signature, dtype=np.float64).reshape(-1, 2)
+    return array[np.lexsort((array[:, 1], array[:, 0]))]
+
+
+def distance_matrix(sig_a, sig_b):
+    """2つのシグネチャのベクトル間のユークリッド距離行列 (len(sig_a), len(sig_b))"""
+    dx = sig_a[:, 0, None] - sig_b[None, :, 0]
+    dy = sig_a[:, 1, None] - sig_b[None, :, 1]
+    return np.sqrt(dx**2 + dy**2)
+
+
+def _similarity(total_distance, len_a, len_b):
+    # compare_signatures と同じ式・同じ演算順で計算する
+    avg_distance = total_distance / len_a
+    similarity = 1 / (1 + avg_distance / 100)
+    len_diff_penalty = 1.0 - (abs(len_a - len_b) / max(len_a, len_b))
+    return similarity * len_diff_penalty
+
+
+def _greedy_dense(sig_a, sig_b):
+    distances = distance_matrix(sig_a, sig_b)
+    total_distance = 0
+    for row in distances[:min(len(sig_a), len(sig_b))]:
+        # 先頭から順に、未使用のうち最も近いベクトルを選ぶ（同距離なら添字の小さい方）
+        best = int(np.argmin(row))
+        total_distance += row[best].item()
+        distances[:, best] = np.inf
+    return total_distance
+
+
+def _greedy_kdtree(sig_a, sig_b):
+    from scipy.spatial import cKDTree
+
+    tree = cKDTree(sig_b)
+    used = np.zeros(len(sig_b), dtype=bool)
+    total_distance = 0
+    for vec_a in sig_a[:min(len(sig_a), len(sig_b))]:
+        k = 1
+        while True:
+            dists, idx = tree.query(vec_a, k=min(k, len(sig_b)))
+            dists, idx = np.atleast_1d(dists), np.atleast_1d(idx)
+            free = ~used[idx]
+            if free.any() or k >= len(sig_b):
+                break
+            k *= 4
+        # 同距離の候補をすべて集め、厳密な距離と添字で選び直す（距離行列版と同じ結果にするため）
+        radius = dists[free][0]
+        near = np.asarray(tree.query_ball_point(vec_a, radius * (1 + 1e-9) + 1e-9), dtype=np.int64)
+        near = near[~used[near]]
+        exact = np.sqrt((sig_b[near, 0] - vec_a[0])**2 + (sig_b[near, 1] - vec_a[1])**2)
+        order = np.lexsort((near, exact))
+        best = near[order[0]]
+        total_distance += exact[order[0]].item()
+        used[best] = True
+    return total_distance
+
+
+def _optimal(sig_a, sig_b):
+    from scipy.optimize import linear_sum_assignment
+
+    distances = distance_matrix(sig_a, sig_b)
+    rows, cols = linear_sum_assignment(distances)
+    return float(distances[rows, cols].sum())
+
+
+def compare_signature_arrays(sig_a, sig_b, mode="greedy"):
+    """
+    compare_signatures の配列版。
+    mode="greedy" は従来と同じ貪欲な対応付けで、スコアも compare_signatures と一致します。
+    mode="optimal" はベクトル間の距離の合計が最小になる対応付け (linear_sum_assignment) を使います。
+    """
+    if len(sig_a) == 0 and len(sig_b) == 0: return 1.0
+    if len(sig_a) == 0 or len(sig_b) == 0: return 0.0
+    if mode == "optimal":
+        total_distance = _optimal(sig_a, sig_b)
+    elif len(sig_b) > KDTREE_MIN_SIZE:
+        total_distance = _greedy_kdtree(sig_a, sig_b)
+    else:
+        total_distance = _greedy_dense(sig_a, sig_b)
+    return _similarity(total_distance, len(sig_a), len(sig_b))
+
+
+def _greedy_batch(sig_a, stack_b):
+    """
+    1つのシグネチャ sig_a と、同じ長さのシグネチャを積み重ねた stack_b (n, L, 2) との貪欲な対応付けを
+    n 組まとめて行い、それぞれの距離の合計を返します。各組の加算順は _greedy_dense と同じです。
+    """
+    dx = sig_a[None, :, 0, None] - stack_b[:, None, :, 0]
+    dy = sig_a[None, :, 1, None] - stack_b[:, None, :, 1]
+    distances = np.sqrt(dx**2 + dy**2)
+    pairs = np.arange(len(stack_b))
+    total_distance = np.zeros(len(stack_b))
+    for row in range(min(len(sig_a), stack_b.shape[1])):
+        best = np.argmin(distances[:, row, :], axis=1)
+        total_distance = total_distance + distances[pairs, row, best]
+        distances[pairs, :, best] = np.inf
+    return total_distance
+
+
+def spatial_similarity_matrix(signatures_a, signatures_b, mode="greedy"):
+    """
+    全ペアの空間類似度行列。
+    greedy モードでは B のシグネチャを長さごとにまとめて積み重ね、A の1クラスと同じ長さの B のクラス群との
+    貪欲な対応付けを配列演算で一度に行います。optimal モードと大きなシグネチャは1組ずつ比較します。
+    """
+    if mode not in SPATIAL_MATCHING_MODES:
+        raise ValueError(f"未知の空間シグネチャの対応付け方法です: {mode} (選択肢: {', '.join(SPATIAL_MATCHING_MODES)})")
+    len_a = np.array([len(sig) for sig in signatures_a], dtype=np.int64)
+    len_b = np.array([len(sig) for sig in signatures_b], dtype=np.int64)
+    spatial = np.where((len_a[:, None] == 0) & (len_b[None, :] == 0), 1.0, 0.0)
+
+    groups = {}
+    for j in np.flatnonzero(len_b):
+        groups.setdefault(int(len_b[j]), []).append(j)
+    stacks = [(length, np.array(cols), np.stack([signatures_b[j] for j in cols]))
+              for length, cols in sorted(groups.items())]
+
+    for i in np.flatnonzero(len_a):
+        sig_a = signatures_a[i]
+        for length, cols, stack in stacks:
+            if mode == "greedy" and length <= KDTREE_MIN_SIZE:
+                avg_distance = _greedy_batch(sig_a, stack) / len(sig_a)
+                len_diff_penalty = 1.0 - (abs(len(sig_a) - length) / max(len(sig_a), length))
+                spatial[i, cols] = (1 / (1 + avg_distance / 100)) * len_diff_penalty
+            else:
+                for j in cols:
+                    spatial[i, j] = compare_signature_arrays(sig_a, signatures_b[j], mode)
+    return spatial
\ No newline at end of file
@@ -0,0 +1,140 @@
+# synthetic_diagrams.py (ベンチマーク用に、それらしいクラス図のペアを生成する)
+#
+# 使い方: python synthetic_diagrams.py クラス数 出力A.txt 出力B.txt [--overlap 0.8] [--rename 0.2] [--seed 0]
+
+import argparse
+import random
+
+from file_io import write_uml_file
+from uml_data import UmlClass, UmlRelation
+
+NOUNS = ["顧客", "注文", "商品", "在庫", "支払", "配送", "社員", "部署", "請求", "契約",
+         "車両", "部品", "予約", "会員", "店舗", "倉庫", "取引", "口座", "講座", "学生",
+         "運転手", "自動車", "エンジン", "タイヤ", "座席", "路線", "駅", "切符", "病院", "患者"]
+SUFFIXES = ["", "情報", "明細", "履歴", "管理", "一覧", "区分", "設定", "台帳", "記録"]
+# 図Bでの名前の付け替えに使う言い換え
+SYNONYMS = {"顧客": "お客様", "注文": "発注", "商品": "製品", "支払": "決済", "配送": "出荷",
+            "社員": "従業員", "部署": "組織", "請求": "請求書", "会員": "メンバー", "自動車": "乗り物",
+            "運転手": "運転者", "部品": "パーツ", "取引": "トランザクション", "学生": "生徒", "患者": "受診者"}
+ATTRIBUTES = ["名前", "番号", "日付", "金額", "数量", "状態", "住所", "電話番号", "備考", "作成日時",
+              "更新日時", "種別", "コード", "税率", "単価", "メール", "サイズ", "メーカー", "モデル", "馬力"]
+RELATION_TYPES = ["SimpleRelation", "Association", "Generalization", "Composition", "Aggregation", "Dependency"]
+MULTIPLICITIES = [None, "1", "0..1", "0..*", "1..*", "4..6"]
+GRID_SPACING = 160
+
+
+def class_names(n_classes, rng):
+    """重複しないクラス名を n_classes 個作ります（組み合わせが尽きたら番号を付けます）。"""
+    combinations = [noun + suffix for noun in NOUNS for suffix in SUFFIXES]
+    rng.shuffle(combinations)
+    return [combinations[i % len(combinations)] + (str(i // len(combinations)) if i >= len(combinations) else "")
+            for i in range(n_classes)]
+
+
+def rename(name, rng):
+    """言い換えの辞書か語尾の付け替えで、意味の近い別名を作ります。"""
+    for word, synonym in SYNONYMS.items():
+        if name.startswith(word):
+            return synonym + name[len(word):]
+    return name + rng.choice(["データ", "エンティティ", "クラス"])
+
+
+def _random_relations(ids, n_relations, rng, next_id):
+    """ids のクラスの間に、近い位置のクラス同士を結びやすい関連を n_relations 本作ります。"""
+    relations = []
+    n = len(ids)
+    if n < 2:
+        return relations
+    for _ in range(n_relations):
+        i = rng.randrange(n)
+        j = min(n - 1, max(0, i + rng.choice([-1, 1]) * rng.randint(1, max(1, min(n - 1, 8)))))
+        if i == j:
+            j = (i + 1) % n
+        relations.append(UmlRelation(str(next_id), ids[i], ids[j], rng.choice(RELATION_TYPES),
+                                     rng.choice(MULTIPLICITIES), rng.choice(MULTIPLICITIES)))
+        next_id += 1
+    return relations
+
+
+def generate_pair(n_classes, n_attributes=(0, 5), relation_density=1.2, overlap=0.8, rename_rate=0.2, seed=0):
+    """
+    同じ対象を別々に描いたような2つのクラス図 (data_a, data_b) を生成します。
+    - n_classes: 各図のクラス数
+    - n_attributes: クラスごとの属性数の範囲 (最小, 最大)
+    - relation_density: クラス1つあたりの関連の本数
+    - overlap: 図Aのクラスのうち図Bにも現れる割合（残りは図Bだけのクラスで埋める）
+    - rename_rate: 共通のクラスのうち図Bで別名にする割合
+    共通のクラスは図Bで位置が少しずれ、属性の順番や一部が入れ替わります。同じ seed なら同じ図になります。
+    """
+    rng = random.Random(seed)
+    names = class_names(2 * n_classes, rng)
+    columns = max(1, int(n_classes ** 0.5))
+
+    def position(i):
+        return (40 + (i % columns) * GRID_SPACING + rng.randint(-30, 30),
+                40 + (i // columns) * GRID_SPACING + rng.randint(-30, 30))
+
+    classes_a = []
+    for i in range(n_classes):
+        attrs = rng.sample(ATTRIBUTES, rng.randint(*n_attributes))
+        classes_a.append(UmlClass(str(100 + i), names[i], attrs, *position(i)))
+    relations_a = _random_relations([c.id for c in classes_a], int(n_classes * relation_density), rng,
+                                    100 + n_classes)
+
+    shared = sorted(rng.sample(range(n_classes), int(round(n_classes * overlap))))
+    classes_b, b_id = [], {}
+    for i in shared:
+        source = classes_a[i]
+        name = rename(source.name, rng) if rng.random() < rename_rate else source.name
+        attrs = list(source.attributes)
+        rng.shuffle(attrs)
+        if attrs and rng.random() < 0.3:
+            attrs.pop()
+        if rng.random() < 0.3:
+            attrs.append(rng.choice([a for a in ATTRIBUTES if a not in attrs]))
+        b_id[source.id] = str(len(classes_b))
+        classes_b.append(UmlClass(b_id[source.id], name, attrs,
+                                  source.x + 80 + rng.randint(-20, 20), source.y + 40 + rng.randint(-20, 20)))
+    for k in range(n_classes - len(shared)):
+        attrs = rng.sample(ATTRIBUTES, rng.randint(*n_attributes))
+        classes_b.append(UmlClass(str(len(classes_b)), names[n_classes + k], attrs, *position(len(shared) + k)))
+
+    # 共通のクラス同士の関連は図Bにも引き継ぎ、足りない分は新しく作る
+    relations_b, next_id = [], len(classes_b)
+    for rel in relations_a:
+        if rel.source_id in b_id and rel.target_id in b_id and rng.random() < 0.8:
+            relations_b.append(UmlRelation(str(next_id), b_id[rel.source_id], b_id[rel.target_id], rel.type,
+                                           rel.source_multiplicity, rel.target_multiplicity))
+            next_id += 1
+    missing = max(0, int(n_classes * relation_density) - len(relations_b))
+    relations_b.extend(_random_relations([c.id for c in classes_b], missing, rng, next_id))
+    return {"classes": classes_a, "relations": relations_a}, {"classes": classes_b, "relations": relations_b}
+
+
+def write_pair(path_a, path_b, n_classes, **options):
+    """generate_pair の結果をクラス図ファイルとして書き出します。"""
+    data_a, data_b = generate_pair(n_classes, **options)
+    write_uml_file(path_a, data_a)
+    write_uml_file(path_b, data_b)
+    return data_a, data_b
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用のクラス図のペアを生成します。")
+    parser.add_argument("classes", type=int, help="各図のクラス数")
+    parser.add_argument("output_a")
+    parser.add_argument("output_b")
+    parser.add_argument("--min-attributes", type=int, default=0)
+    parser.add_argument("--max-attributes", type=int, default=5)
+    parser.add_argument("--relation-density", type=float, default=1.2)
+    parser.add_argument("--overlap", type=float, default=0.8)
+    parser.add_argument("--rename", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_pair(args.output_a, args.output_b, args.classes,
+               n_attributes=(args.min_attributes, args.max_attributes), relation_density=args.relation_density,
+               overlap=args.overlap, rename_rate=args.rename, seed=args.seed)
+    print(f"{args.classes} クラスの図を '{args.output_a}' と '{args.output_b}' に書き出しました。")
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@
 
 class UmlClass:
     """クラスの情報を保持するクラス"""
+    __slots__ = ("id", "name", "attributes", "x", "y")
+
     def __init__(self, id, name, attributes, x=0, y=0):
         self.id = id
         self.name = name
@@ -15,6 +17,8 @@ class UmlClass:
 # ▼▼▼ 変更点 ▼▼▼
 class UmlRelation:
     """関連の情報を保持するクラス"""
+    __slots__ = ("id", "source_id", "target_id", "type", "source_multiplicity", "target_multiplicity")
+
     def __init__(self, id, source_id, target_id, rel_type='SimpleRelation',
                  source_multi='None', target_multi='None'):
         self.id = id